@@ -6,6 +6,20 @@ superclass.
 from PIL import Image
 from json import dumps
 from copy import deepcopy
+from itertools import count
+import weakref
+
+from ddl.image_cache import IMAGE_CACHE
+
+# Hands out the IDs image assets keep their cached images under.
+CACHE_IDS = count()
+
+# How to transpose an image for each (h_flip, v_flip) combination.
+FLIP_TRANSPOSITIONS = {
+    (True, False): Image.FLIP_LEFT_RIGHT,
+    (False, True): Image.FLIP_TOP_BOTTOM,
+    (True, True): Image.ROTATE_180
+}
 
 
 class Asset:
@@ -47,16 +61,20 @@ class ComponentAsset(Asset):
             self.parts = data["parts"]
 
             self.parts_instantiated = False
+            self.image_layout = None
             self.reset_sub_parts()
         else:
             raise Exception('Component {} has no parts.',
                             self.data["name"])
         self.tags = data["tags"]
+        # How likely this is to be picked at random, relative to others.
+        self.weight = data.get("weight", 1)
 
     def reset_sub_parts(self):
         """Sets the ID of any sub parts to be the full_id of the part"""
         for sub_part in self.parts:
             sub_part["asset_id"] = self.get_part_full_id(sub_part)
+        self.invalidate_image_layout()
 
     def instantiate_sub_parts(self):
         """Instantiates the sub part list. This should only be a temporary measure
@@ -69,30 +87,62 @@ class ComponentAsset(Asset):
                 sub_component = self.assetpack.components[sub_part['asset_id']]
                 sub_part['asset'] = sub_component
         self.parts_instantiated = True
+        self.invalidate_image_layout()
 
-    def get_image_location_list(self, offset_x, offset_y):
+    def invalidate_image_layout(self):
+        """Throws away the flattened image layout, as the parts have changed"""
+        self.image_layout = None
+
+    def parts_changed(self):
+        """Throws away this component's image layout, and those of any
+         components in the assetpack that are built from it"""
+        self.invalidate_image_layout()
+        invalidate_component = getattr(self.assetpack, 'invalidate_component',
+                                       None)
+        if invalidate_component is not None:
+            invalidate_component(self)
+
+    def get_image_layout(self):
         """
-        For a given component, recurses down it's tree of parts until we end
-        up with nothing but a list of images and their absolute (by grid)
-        offsets
+        Gets the list of images in this component and their grid offsets
+        relative to (0, 0). This is only worked out again if the parts have
+        changed, and sub-components reuse their own layouts rather than
+        being walked again.
         """
+        if self.image_layout is not None:
+            return self.image_layout
         if not self.parts_instantiated:
             self.instantiate_sub_parts()
 
-        image_location_list = []
+        image_layout = []
         for part in self.parts:
-            part_offset_x = part["x"]+offset_x
-            part_offset_y = part["y"]+offset_y
+            part_x = part["x"]
+            part_y = part["y"]
             if isinstance(part["asset"], ComponentAsset):
-                image_location_list = image_location_list + part["asset"].\
-                    get_image_location_list(part_offset_x, part_offset_y)
+                image_layout.extend(
+                    (image, x_coordinate+part_x, y_coordinate+part_y,
+                     h_flip, v_flip)
+                    for image, x_coordinate, y_coordinate, h_flip, v_flip
+                    in part["asset"].get_image_layout())
             else:
-                image_location_list = image_location_list + [(part["asset"],
-                                                              part_offset_x,
-                                                              part_offset_y,
-                                                              part.get("flip_horizontally", False),
-                                                              part.get("flip_vertically", False))]
-        return image_location_list
+                image_layout.append((part["asset"],
+                                     part_x,
+                                     part_y,
+                                     part.get("flip_horizontally", False),
+                                     part.get("flip_vertically", False)))
+        self.image_layout = image_layout
+        return image_layout
+
+    def get_image_location_list(self, offset_x, offset_y):
+        """
+        For a given component, flattens it's tree of parts until we end
+        up with nothing but a list of images and their absolute (by grid)
+        offsets
+        """
+        return [(image, x_coordinate+offset_x, y_coordinate+offset_y,
+                 h_flip, v_flip)
+                for image, x_coordinate, y_coordinate, h_flip, v_flip
+                in self.get_image_layout()]
 
     def get_part_full_id(self, sub_part):
         """Gives the correct part id, given the assetpack."""
@@ -111,9 +161,10 @@ class ComponentAsset(Asset):
     def rescale(self, scale_ratio_x, scale_ratio_y):
         """Alters all the co-ordinates in a blueprint to match a new
          co-ordinate system."""
-        for sub_asset in self.data["parts"]:
+        for sub_asset in self.parts:
             sub_asset["x"] = sub_asset["x"] / scale_ratio_x
             sub_asset["y"] = sub_asset["y"] / scale_ratio_y
+        self.parts_changed()
 
     def add_image(self, image, x_coordinate, y_coordinate,
                   h_flip=False, v_flip=False):
@@ -128,7 +179,10 @@ class ComponentAsset(Asset):
             sub_asset['flip_horizontally'] = True
         if v_flip:
             sub_asset['flip_vertically'] = True
+        if self.parts_instantiated:
+            sub_asset['asset'] = image
         self.parts = self.parts+[sub_asset]
+        self.parts_changed()
 
     def add_component(self, component, x_coordinate, y_coordinate):
         """Adds a specific component to the component at grid co-ordinates
@@ -138,25 +192,31 @@ class ComponentAsset(Asset):
                      "x": x_coordinate,
                      "y": y_coordinate,
                      "asset_id": component.get_full_id()}
+        if self.parts_instantiated:
+            sub_asset['asset'] = component
         self.parts = self.parts+[sub_asset]
+        self.parts_changed()
 
     def remove_last_part(self):
         """Removes the last part (and therefore all it's sub-parts)."""
         self.parts.pop()
+        self.parts_changed()
 
     def get_data(self):
         """Creates the original component data to either return or print."""
-        parts = deepcopy(self.parts)
-        for part in parts:
-            part.pop('asset_id', None)
-            if self.parts_instantiated:
-                part.pop('asset', None)
-        return {
+        # Leave out the instantiated assets, rather than copying them.
+        parts = [deepcopy({key: value for key, value in part.items()
+                           if key not in ['asset', 'asset_id']})
+                 for part in self.parts]
+        data = {
             "name": self.name,
             "id": self.asset_id,
             "parts": parts,
             "tags": self.tags
         }
+        if self.weight != 1:
+            data["weight"] = self.weight
+        return data
 
     def get_json(self):
         """Prints the component in json"""
@@ -165,44 +225,339 @@ class ComponentAsset(Asset):
 
 class ImageAsset(Asset):
     """A representation of an actual image file and the pixel offsets required
-     to put it in the correct location."""
-    def __init__(self, data, assetpack_id, assetpack_path):
+     to put it in the correct location.
+     Lazy images only read the image header when created, and decode their
+     pixels into the shared image cache the first time they are needed.
+     If an already decoded RGBA image is passed in, the file isn't read.
+     Trimmed images have their fully transparent margins cropped away."""
+    def __init__(self, data, assetpack_id, assetpack_path, lazy=False,
+                 image=None, trim=False):
         super().__init__(data, assetpack_id)
         if "top_left" in data.keys():
             self.top_left = data["top_left"]
         else:
             self.top_left = {"x": 0, "y": 0}
 
-        self.image = Image.open(assetpack_path + '/art/' +
-                                data["image"])
-        if self.image.mode != 'RGBA':
-            self.image = self.image.convert('RGBA')
+        self.path = assetpack_path + '/art/' + data["image"]
+        self.lazy = lazy
+        # Bumped whenever the pixels change, so cached copies go stale.
+        self.image_version = 0
+        # Alpha classification and crop boxes, see get_paste_info.
+        self.alpha_metadata = {}
+        # The part of the image file actually used, if it has been trimmed.
+        self.crop_box = None
+        # Scaled views of this image that are still in use, see scaled.
+        self.scaled_images = weakref.WeakValueDictionary()
+        self.init_cache()
+        if image is not None:
+            self.lazy = False
+            self._image = image
+            self.size = image.size
+        elif lazy:
+            # Opening an image only reads the header, not the pixels.
+            with Image.open(self.path) as image:
+                self.size = image.size
+            self._image = None
+        else:
+            self._image = self.decode()
+            self.size = self._image.size
+        if trim:
+            self.trim()
+
+    def init_cache(self):
+        """Gives the image an ID to key its cached images on. The cache only
+         holds the ID, not the asset, so the asset can still be garbage
+         collected, and its cached images go with it."""
+        self.cache_id = next(CACHE_IDS)
+        weakref.finalize(self, IMAGE_CACHE.forget_owner, self.cache_id)
+
+    def get_cached(self, key, loader):
+        """Gets one of this image's variants from the shared image cache,
+         making it with loader if it isn't there."""
+        return IMAGE_CACHE.get((self.cache_id, self.image_version) + key,
+                               loader, owner=self.cache_id)
+
+    def decode(self):
+        """Reads the image from disk as RGBA, at the current size."""
+        image = Image.open(self.path)
+        # Opening only reads the header, so make sure we decode here.
+        image.load()
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        if self.crop_box is not None:
+            image = image.crop(self.crop_box)
+        if self.lazy and image.size != self.size:
+            image = image.resize(self.size)
+        return image
+
+    @property
+    def image(self):
+        """The decoded image, which may be fetched from the image cache"""
+        if self.lazy:
+            return self.get_cached((False, False), self.decode)
+        return self._image
 
     def resize(self, size_ratio_x, size_ratio_y):
         """Alters the image and it's top_left pixel offsets by some x and y
-         scale factors"""
-        final_image_width = round(self.image.width*size_ratio_x)
-        final_image_height = round(self.image.height*size_ratio_y)
-        self.image = self.image.resize((final_image_width, final_image_height))
+         scale factors. Lazy images are resized the next time they decode."""
+        final_image_width = round(self.size[0]*size_ratio_x)
+        final_image_height = round(self.size[1]*size_ratio_y)
+        self.size = (final_image_width, final_image_height)
+        self.image_version = self.image_version + 1
+        if not self.lazy:
+            self._image = self._image.resize(self.size)
         self.top_left['x'] = round(self.top_left['x']*size_ratio_x)
         self.top_left['y'] = round(self.top_left['y']*size_ratio_y)
 
+    def trim(self):
+        """
+        Crops the image down to its non-transparent pixels, and moves
+        top_left by the same amount so everything still renders onto the
+        same pixels, flipped or not. Lazy images are decoded once here to
+        find their margins, but only remember the crop box.
+        """
+        image = self.decode() if self.lazy else self._image
+        box = image.getchannel('A').getbbox()
+        if box is None or box == (0, 0, image.width, image.height):
+            return
+        if self.lazy:
+            self.crop_box = box
+        else:
+            self._image = image.crop(box)
+        self.size = (box[2]-box[0], box[3]-box[1])
+        # top_left may be shared with the image's JSON, so don't alter it.
+        self.top_left = {"x": self.top_left["x"] - box[0],
+                         "y": self.top_left["y"] - box[1]}
+        self.image_version = self.image_version + 1
+
     def get_image_sizes(self):
-        """Returns the width and height of the image"""
-        return (self.image.width, self.image.height)
+        """Returns the width and height of the image, without decoding it"""
+        return self.size
 
     def get_image(self, h_flip=False, v_flip=False):
         """
-        Gets the image, takign into account flipping (and probably scaling
-        once we move to more efficient storage)
+        Gets the image, taking into account flipping (and probably scaling
+        once we move to more efficient storage). Flipped images are kept in
+        the shared image cache, so each variant is only made once.
+        """
+        if not (h_flip or v_flip):
+            return(self.image)
+        return self.get_cached((h_flip, v_flip),
+                               lambda: self.image.transpose(
+                                   FLIP_TRANSPOSITIONS[(h_flip, v_flip)]))
+
+    def get_mipmap(self, level):
+        """
+        Gets the image halved in size level times over. Each level is made
+        from the one above it the first time it's needed, and kept in the
+        shared image cache.
+        """
+        if level == 0:
+            return self.image
+
+        def halve():
+            """Box filters the level above down to half its size"""
+            image = self.get_mipmap(level-1)
+            return image.resize((max(1, (image.width+1)//2),
+                                 max(1, (image.height+1)//2)), Image.BOX)
+
+        return self.get_cached(('mipmap', level), halve)
+
+    def get_mipmap_level(self, size):
+        """Gets the smallest mipmap level that is still at least as big as
+         size in both directions, so it only ever needs shrinking."""
+        level = 0
+        width, height = self.size
+        while (width > 1 or height > 1) and\
+                (width+1)//2 >= size[0] and (height+1)//2 >= size[1]:
+            width = max(1, (width+1)//2)
+            height = max(1, (height+1)//2)
+            level = level + 1
+        return level
+
+    def scaled(self, scale_x, scale_y=None):
+        """
+        Gets a view of this image scaled by some x and y scale factors,
+        without touching this image. Views are resampled from the nearest
+        mipmap level when they're first drawn. While a scale's view is in
+        use, the same view is handed out again.
+        """
+        if scale_y is None:
+            scale_y = scale_x
+        if scale_x == 1 and scale_y == 1:
+            return self
+        key = (self.image_version, scale_x, scale_y)
+        scaled_image = self.scaled_images.get(key)
+        if scaled_image is None:
+            scaled_image = ScaledImageAsset(self, scale_x, scale_y)
+            self.scaled_images[key] = scaled_image
+        return scaled_image
+
+    def get_alpha_masks(self, h_flip=False, v_flip=False):
+        """
+        Gets a pair of masks for the (possibly flipped) image: where it is
+        visible at all, and where it is completely opaque. Each is worked out
+        once from the alpha channel and kept in the shared image cache.
+        """
+        def get_visible_mask():
+            """Masks every pixel that isn't fully transparent"""
+            return self.get_image(h_flip, v_flip).getchannel('A')\
+                .point(lambda alpha: 255 if alpha > 0 else 0)
+
+        def get_opaque_mask():
+            """Masks every pixel that is fully opaque"""
+            return self.get_image(h_flip, v_flip).getchannel('A')\
+                .point(lambda alpha: 255 if alpha == 255 else 0)
+
+        key = (h_flip, v_flip)
+        return (self.get_cached(key + ('visible',), get_visible_mask),
+                self.get_cached(key + ('opaque',), get_opaque_mask))
+
+    def get_alpha_class(self):
+        """
+        Classifies the image's alpha channel as 'opaque' (no transparency at
+        all), 'binary' (every pixel either fully transparent or fully opaque)
+        or 'alpha' (anything else). Flipping doesn't change this.
+        """
+        key = (self.image_version, 'alpha_class')
+        if key not in self.alpha_metadata:
+            alpha = self.image.getchannel('A')
+            if alpha.getextrema() == (255, 255):
+                alpha_class = 'opaque'
+            elif sum(alpha.histogram()[1:255]) == 0:
+                alpha_class = 'binary'
+            else:
+                alpha_class = 'alpha'
+            self.alpha_metadata[key] = alpha_class
+        return self.alpha_metadata[key]
+
+    def get_visible_box(self, h_flip=False, v_flip=False):
+        """Gets the bounding box of the (possibly flipped) image's pixels
+         that aren't fully transparent, or None if there aren't any."""
+        key = (self.image_version, h_flip, v_flip)
+        if key not in self.alpha_metadata:
+            # Any alpha above zero is visible, so no mask needs making here.
+            self.alpha_metadata[key] = self.get_image(h_flip, v_flip)\
+                .getchannel('A').getbbox()
+        return self.alpha_metadata[key]
+
+    def find_opaque_box(self):
+        """
+        Finds the biggest rectangle of the image that is completely opaque,
+        or None if no pixel is. Each row's run of opaque pixels is stacked
+        on the row above's, and the biggest rectangle under each row's
+        heights is found with a stack.
+        """
+        alpha = self.image.getchannel('A')
+        width, height = alpha.size
+        if alpha.getextrema() == (255, 255):
+            return (0, 0, width, height)
+        opaque = alpha.point(lambda value: 1 if value == 255 else 0)\
+            .tobytes()
+        heights = [0] * width
+        best_area = 0
+        best_box = None
+        for bottom in range(1, height+1):
+            row = opaque[(bottom-1)*width:bottom*width]
+            heights = [column_height+1 if is_opaque else 0
+                       for column_height, is_opaque in zip(heights, row)]
+            stack = []
+            for right, column_height in enumerate(heights + [0]):
+                left = right
+                while stack and stack[-1][1] >= column_height:
+                    left, stacked_height = stack.pop()
+                    area = stacked_height*(right-left)
+                    if area > best_area:
+                        best_area = area
+                        best_box = (left, bottom-stacked_height, right,
+                                    bottom)
+                stack.append((left, column_height))
+        return best_box
+
+    def get_opaque_box(self, h_flip=False, v_flip=False):
+        """
+        Gets the biggest completely opaque rectangle of the (possibly
+        flipped) image, or None if no pixel is opaque. Anything under this
+        rectangle is painted over, so it can be used to cull images cheaply.
+        It is only found once, and flipped to match.
         """
+        key = (self.image_version, 'opaque_box')
+        if key not in self.alpha_metadata:
+            self.alpha_metadata[key] = self.find_opaque_box()
+        box = self.alpha_metadata[key]
+        if box is None:
+            return None
+        left, top, right, bottom = box
+        width, height = self.size
         if h_flip:
-            return(self.image.transpose(Image.FLIP_LEFT_RIGHT))
-        elif v_flip:
-            return(self.image.transpose(Image.FLIP_TOP_BOTTOM))
+            left, right = width-right, width-left
+        if v_flip:
+            top, bottom = height-bottom, height-top
+        return (left, top, right, bottom)
+
+    def get_paste_info(self, h_flip=False, v_flip=False):
+        """
+        Gets the cheapest way to paste the (possibly flipped) image: the
+        image cropped to its non-transparent pixels, the offset of the crop
+        within the full image, and the mask to paste with. Opaque images need
+        no mask, and images with binary alpha use a 1-bit mask. Fully
+        transparent images have nothing to paste, so get None.
+        """
+        box = self.get_visible_box(h_flip, v_flip)
+        if box is None:
+            return (None, 0, 0, None)
+
+        image = self.get_image(h_flip, v_flip)
+        cache_key = (h_flip, v_flip)
+        if box != (0, 0, image.width, image.height):
+            image = self.get_cached(cache_key + ('cropped',),
+                                    lambda: image.crop(box))
+
+        alpha_class = self.get_alpha_class()
+        if alpha_class == 'opaque':
+            mask = None
+        elif alpha_class == 'binary':
+            mask = self.get_cached(cache_key + ('binary_mask',),
+                                   lambda: image.getchannel('A').convert('1'))
         else:
-            return(self.image)
+            mask = image
+        return (image, box[0], box[1], mask)
 
     def show(self):
         """Show the image."""
         self.image.show()
+
+
+class ScaledImageAsset(ImageAsset):
+    """A lazily resampled view of an image asset at a different scale, with
+     its top_left pixel offsets scaled to match. Only the source image is
+     ever read from disk, and the view's pixels are cached as variants of the
+     source image, so they go when it does."""
+    def __init__(self, source, scale_x, scale_y):
+        Asset.__init__(self, source.data, source.assetpack_id)
+        self.source = source
+        self.scale = (scale_x, scale_y)
+        self.top_left = {"x": round(source.top_left["x"]*scale_x),
+                         "y": round(source.top_left["y"]*scale_y)}
+        self.path = source.path
+        self.lazy = True
+        self.image_version = 0
+        self.alpha_metadata = {}
+        self.crop_box = None
+        self.scaled_images = weakref.WeakValueDictionary()
+        source_width, source_height = source.get_image_sizes()
+        self.size = (max(1, round(source_width*scale_x)),
+                     max(1, round(source_height*scale_y)))
+
+    def get_cached(self, key, loader):
+        """Gets one of this view's variants from the shared image cache, as
+         a variant of the source image."""
+        return self.source.get_cached(('scaled',) + self.scale +
+                                      (self.image_version,) + key, loader)
+
+    def decode(self):
+        """Resamples the nearest mipmap level of the source image."""
+        image = self.source.get_mipmap(self.source.get_mipmap_level(self.size))
+        if image.size != self.size:
+            image = image.resize(self.size, Image.LANCZOS)
+        return image
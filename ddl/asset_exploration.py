@@ -2,7 +2,7 @@
 
 from PyInquirer import prompt
 from ddl.projection import IsometricProjection
-from ddl.renderer import Renderer
+from ddl.render_cache import RENDER_CACHE
 from ddl.asset import ImageAsset
 from ddl.cli_utils import *
 import json
@@ -69,10 +69,7 @@ def print_component_info(component):
 
 def show_component(assetpack, component):
     """Shows a component in it's own little window"""
-    image_location_list = component.get_image_location_list(0, 0)
-    renderer = Renderer(image_pixel_list=assetpack.projection
-                        .get_image_pixel_list(0, 0, image_location_list))
-    renderer.output('screen')
+    RENDER_CACHE.render(component, assetpack.projection).show()
 
 
 def get_asset(assetpack, initial_option):
@@ -0,0 +1,120 @@
+"""
+Asset index
+
+A lookup of assets by full ID, split up by assetpack ID so that whole
+assetpacks' worth of assets can be shared between merged assetpacks rather
+than copied.
+"""
+
+from collections.abc import MutableMapping
+from itertools import chain
+
+
+def split_full_id(full_id):
+    """Splits a full ID into its assetpack ID and asset ID. Asset IDs can't
+     contain dots, so anything before the last dot is the assetpack ID."""
+    pack_id, _, asset_id = full_id.rpartition('.')
+    return (pack_id, asset_id)
+
+
+class AssetIndex(MutableMapping):
+    """
+    A mapping of full IDs to assets, stored as one dict of assets per
+    assetpack ID. Merging another index shares its dicts by reference. A
+    shared dict is only copied when either side changes it.
+    """
+    def __init__(self, assets=None):
+        self.namespaces = {}
+        # Assetpack IDs whose dicts no other index is using.
+        self.owned = set()
+        self.size = 0
+        if assets is not None:
+            self.update(assets)
+
+    def get_namespace(self, pack_id, create=False):
+        """Gets the dict of one assetpack's assets, ready to be changed. Dicts
+         shared with another index are copied first."""
+        namespace = self.namespaces.get(pack_id)
+        if namespace is None:
+            if not create:
+                raise KeyError(pack_id)
+            namespace = {}
+            self.namespaces[pack_id] = namespace
+            self.owned.add(pack_id)
+        elif pack_id not in self.owned:
+            namespace = dict(namespace)
+            self.namespaces[pack_id] = namespace
+            self.owned.add(pack_id)
+        return namespace
+
+    def __getitem__(self, full_id):
+        return self.namespaces[split_full_id(full_id)[0]][full_id]
+
+    def __contains__(self, full_id):
+        namespace = self.namespaces.get(split_full_id(full_id)[0])
+        return namespace is not None and full_id in namespace
+
+    def __setitem__(self, full_id, asset):
+        namespace = self.get_namespace(split_full_id(full_id)[0], create=True)
+        if full_id not in namespace:
+            self.size = self.size + 1
+        namespace[full_id] = asset
+
+    def __delitem__(self, full_id):
+        pack_id = split_full_id(full_id)[0]
+        if full_id not in self:
+            raise KeyError(full_id)
+        namespace = self.get_namespace(pack_id)
+        del namespace[full_id]
+        self.size = self.size - 1
+        if not namespace:
+            del self.namespaces[pack_id]
+            self.owned.discard(pack_id)
+
+    def __iter__(self):
+        return chain.from_iterable(self.namespaces.values())
+
+    def __len__(self):
+        return self.size
+
+    def values(self):
+        """All the assets, without looking each one up again"""
+        return list(chain.from_iterable(
+            namespace.values() for namespace in self.namespaces.values()))
+
+    def items(self):
+        """All the full IDs and assets, without looking each one up again"""
+        return list(chain.from_iterable(
+            namespace.items() for namespace in self.namespaces.values()))
+
+    def get_conflicts(self, index):
+        """Gets the full IDs that are in both this index and another. Only
+         assetpacks in both need checking, and those are checked a whole
+         dict at a time."""
+        conflicts = []
+        for pack_id, namespace in index.namespaces.items():
+            own_namespace = self.namespaces.get(pack_id)
+            if own_namespace is not None:
+                conflicts.extend(
+                    full_id for full_id in own_namespace.keys() &
+                    namespace.keys()
+                    if own_namespace[full_id] is not namespace[full_id])
+        return conflicts
+
+    def merge(self, index):
+        """
+        Adds everything in another index to this one. Assetpacks that this
+        index doesn't have yet are shared rather than copied. Check
+        get_conflicts first, as an asset in both indexes is overwritten.
+        """
+        for pack_id, namespace in index.namespaces.items():
+            if pack_id not in self.namespaces:
+                self.namespaces[pack_id] = namespace
+                # Neither index can change this dict in place any more.
+                index.owned.discard(pack_id)
+                self.size = self.size + len(namespace)
+            else:
+                own_namespace = self.get_namespace(pack_id)
+                self.size = self.size - len(own_namespace)
+                own_namespace.update(namespace)
+                self.size = self.size + len(own_namespace)
@@ -2,11 +2,15 @@
 The assetpack and assetpack factory methods.
 """
 
-import json
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import os
 
 from ddl.projection import IsometricProjection, TopDownProjection
 from ddl.asset import ComponentAsset, ImageAsset
+from ddl.asset_index import AssetIndex
+from ddl.dependency_graph import DependencyGraph
+from ddl.pack_cache import compile_assetpack, is_cache_fresh, load_cache
 from ddl.taglist import TagList
 from ddl.validator import Validator
 
@@ -24,60 +28,85 @@ class ProjectionGridException(Exception):
 class AssetpackFactory:
     """A factory for creating AssetPacks"""
     @staticmethod
-    def load(path):
+    def load(path, lazy_images=False, use_cache=False, shared_pixels=False,
+             image_workers=None, trim_images=False):
         """
         Validates and loads AssetPacks from their component and Image packs,
-        given an appropriate name
+        given an appropriate name. If lazy_images is set, images are only
+        decoded when first rendered, and may be evicted again to keep memory
+        use down.
+        If use_cache is set and the assetpack has a compiled cache file that
+        is newer than all its sources, that is loaded instead of validating
+        the sources again, and its pixels are memory-mapped.
+        If shared_pixels is set, the cache is compiled first if need be, so
+        that every process loading the assetpack shares one read-only copy
+        of the pixels through the operating system's page cache.
+        Images are decoded on a pool of image_workers threads, which defaults
+        to one per CPU (plus a few).
+        If trim_images is set, images have their transparent margins cropped
+        off, which saves memory and pasting time without changing where
+        anything ends up.
         """
 
         pack_path = os.path.abspath(path)
 
-        Validator.validate_file(pack_path + '/pack.json',
-                                'pack')
-        Validator.validate_file(pack_path + '/images.json',
-                                'images')
-        Validator.validate_file(pack_path + '/components.json',
-                                'components')
-        with open(
-                pack_path + '/pack.json'
-                ) as pack_file, open(
-                pack_path + '/components.json'
-                ) as components_file, open(
-                pack_path + '/images.json'
-                ) as imagepack_file:
-
-            pack_json = json.load(pack_file)
-            components_json = json.load(components_file)
-            images_json = json.load(imagepack_file)
-
-            Validator.validate_json(pack_json, 'pack')
-            Validator.validate_json(images_json, 'images')
-            Validator.validate_json(components_json, 'components')
-
-            pack_id = pack_json['id']
-
-            if pack_json['projection'] == 'isometric':
-                projection = IsometricProjection(pack_json['grid']['width'],
-                                                 pack_json['grid']['height'])
-            else:
-                projection = TopDownProjection(pack_json['grid']['width'],
-                                               pack_json['grid']['height'])
+        use_compiled = use_cache and is_cache_fresh(pack_path)
+        if shared_pixels and not use_compiled:
+            compile_assetpack(pack_path)
+            use_compiled = True
+
+        if use_compiled:
+            pack_json, images_json, components_json, cached_images = \
+                load_cache(pack_path)
+        else:
+            pack_json = Validator.validate_file(pack_path + '/pack.json',
+                                                'pack')
+            images_json = Validator.validate_file(pack_path + '/images.json',
+                                                  'images')
+            components_json = Validator.validate_file(pack_path +
+                                                      '/components.json',
+                                                      'components')
+            cached_images = [None] * len(images_json['images'])
+
+        pack_id = pack_json['id']
+
+        if pack_json['projection'] == 'isometric':
+            projection = IsometricProjection(pack_json['grid']['width'],
+                                             pack_json['grid']['height'])
+        else:
+            projection = TopDownProjection(pack_json['grid']['width'],
+                                           pack_json['grid']['height'])
+
+        assetpack = Assetpack(pack_id, projection)
 
-            assetpack = Assetpack(pack_id, projection)
+        def make_image(image, cached_image):
+            """Creates (and so decodes) one image asset"""
+            return ImageAsset(image,
+                              assetpack_id=pack_id,
+                              assetpack_path=pack_path,
+                              lazy=lazy_images,
+                              image=cached_image,
+                              trim=trim_images
+                              )
 
-            for image in images_json['images']:
-                new_image = ImageAsset(image,
-                                       assetpack_id=pack_id,
-                                       assetpack_path=pack_path
-                                       )
+        # Pillow releases the GIL while decoding, so threads help here.
+        # Results come back in order, so any error is raised in the same
+        # place it would be if we decoded one image at a time.
+        with ThreadPoolExecutor(max_workers=image_workers) as executor:
+            for new_image in executor.map(make_image, images_json['images'],
+                                          cached_images):
                 assetpack.add_image(new_image)
 
-            for component in components_json['components']:
-                new_component = ComponentAsset(component, assetpack)
-                assetpack.taglist.add_component(new_component)
-                assetpack.add_component(new_component)
+        for component in components_json['components']:
+            assetpack.add_component(ComponentAsset(component, assetpack))
 
-            return assetpack
+        # Fail now, rather than halfway through a render, if any component
+        # is missing a part or contains itself.
+        dependency_graph = assetpack.get_dependency_graph()
+        dependency_graph.check_parts(pack_id)
+        assetpack.precompute_image_layouts()
+
+        return assetpack
 
 
 class Assetpack:
@@ -86,18 +115,69 @@ class Assetpack:
      Please see the assetpack and imagepack schema for more info"""
     def __init__(self, pack_id, projection):
 
-        self.components = {}
-        self.images = {}
+        self.components = AssetIndex()
+        self.images = AssetIndex()
         self.pack_id = pack_id
         self.projection = projection
         self.taglist = TagList()
+        # Views of this assetpack on other grid sizes, see get_view.
+        self.views = {}
+        # Which components use which parts. Built when first needed, and
+        # thrown away whenever components are added or removed.
+        self.dependency_graph = None
+        # Assetpacks this one has been appended to, whose components may be
+        # built from this one's.
+        self.appended_to = []
 
     def add_component(self, new_asset):
-        """Adds a component to the componentlist, if it doesn't exist"""
+        """Adds a component to the componentlist and the taglist, if it
+         doesn't exist"""
         if self.components.setdefault(new_asset.get_full_id(),
                                       new_asset) != new_asset:
             raise ValueError('''The key %s is overloaded. Please ensure no\
  components share IDs''' % new_asset.get_full_id())
+        self.taglist.add_component(new_asset)
+        self.dependency_graph = None
+
+    def remove_component(self, component_id):
+        """Removes a component from the componentlist and the taglist, given
+         its full ID"""
+        del self.components[component_id]
+        self.taglist.remove_component(component_id)
+        self.dependency_graph = None
+
+    def rename_component(self, component_id, new_asset_id):
+        """
+        Gives a component a new ID within the assetpack it came from, which
+        may have been appended to this one, updating the taglist and any
+        components that use it as a part.
+        """
+        component = self.components[component_id]
+        new_component_id = component.assetpack_id + '.' + new_asset_id
+        if new_component_id in self.components:
+            raise ValueError('''The key %s is overloaded. Please ensure no\
+ components share IDs''' % new_component_id)
+        dependant_ids = self.get_dependency_graph().component_dependants\
+            .get(component_id, set())
+        self.taglist.rename_component(component_id, new_component_id)
+        del self.components[component_id]
+        component.asset_id = new_asset_id
+        self.components[new_component_id] = component
+        for dependant_id in dependant_ids:
+            if dependant_id == component_id:
+                other_component = component
+            else:
+                other_component = self.components[dependant_id]
+            for part in other_component.parts:
+                if part['type'] == 'component' and\
+                        part['asset_id'] == component_id:
+                    if '.' in part['component_id']:
+                        part['component_id'] = new_component_id
+                    else:
+                        part['component_id'] = new_asset_id
+                    part['asset_id'] = new_component_id
+            other_component.invalidate_image_layout()
+        self.dependency_graph = None
 
     def add_image(self, new_asset):
         """Adds an image to the imagelist, if it doesn't already exist"""
@@ -118,12 +198,23 @@ class Assetpack:
         if self.projection.width != assetpack.projection.width:
             raise ProjectionGridException()
 
-        for image in assetpack.images.values():
-            self.add_image(image)
-        for component in assetpack.components.values():
-            self.add_component(component)
+        # Check everything before changing anything, so a failed append
+        # leaves this assetpack as it was.
+        conflicts = self.images.get_conflicts(assetpack.images)
+        if conflicts:
+            raise ValueError('''The key %s is overloaded. Please ensure no\
+ images share IDs''' % conflicts[0])
+        conflicts = self.components.get_conflicts(assetpack.components)
+        if conflicts:
+            raise ValueError('''The key %s is overloaded. Please ensure no\
+ components share IDs''' % conflicts[0])
 
+        # Whole assetpacks' worth of assets and tags are merged at once.
+        self.images.merge(assetpack.images)
+        self.components.merge(assetpack.components)
         self.taglist.append(assetpack.taglist)
+        self.dependency_graph = None
+        assetpack.appended_to.append(self)
 
     def change_assetpack_id(self, new_id):
         """
@@ -132,23 +223,85 @@ class Assetpack:
         """
         new_images = self.images
         new_components = self.components
-        self.images = {}
-        self.components = {}
-        for component in new_components.values():
+        self.images = AssetIndex()
+        self.components = AssetIndex()
+        for component_id, component in new_components.items():
             component.assetpack_id = new_id
             component.reset_sub_parts()
-            self.add_component(component)
+            self.taglist.rename_component(component_id,
+                                          component.get_full_id())
+            self.components[component.get_full_id()] = component
         for image in new_images.values():
             image.assetpack_id = new_id
             image.reset_sub_parts()
             self.add_image(image)
         self.pack_id = new_id
+        self.dependency_graph = None
+
+    def get_dependency_graph(self):
+        """Gets the graph of which components use which parts"""
+        if self.dependency_graph is None:
+            self.dependency_graph = DependencyGraph(self.components,
+                                                    self.images)
+        return self.dependency_graph
+
+    def precompute_image_layouts(self):
+        """
+        Flattens every component's image layout, working from the components
+        that use no other components upwards, so each layout is only worked
+        out once and nothing recurses. Components using parts from assetpacks
+        that haven't been appended yet are left until they're needed.
+        """
+        dependency_graph = self.get_dependency_graph()
+        unresolved = {component_id for component_id, _
+                      in dependency_graph.get_missing_parts()}
+        for component_id in dependency_graph.get_topological_order():
+            if component_id in unresolved or\
+                    unresolved & dependency_graph.component_parts[
+                        component_id]:
+                unresolved.add(component_id)
+                continue
+            self.components[component_id].get_image_layout()
+
+    def invalidate_component(self, component):
+        """Throws away the image layouts of everything built from a
+         component, after its parts have changed, here and in any assetpack
+         this one has been appended to."""
+        component_id = component.get_full_id()
+        if self.components.get(component_id) is component:
+            dependency_graph = self.get_dependency_graph()
+            dependency_graph.update_component(component)
+            for dependant_id in dependency_graph.get_dependants(component_id):
+                self.components[dependant_id].invalidate_image_layout()
+        for assetpack in self.appended_to:
+            assetpack.invalidate_component(component)
+
+    def invalidate_image(self, image):
+        """Throws away the image layouts of everything built from an image,
+         after it has changed, here and in any assetpack this one has been
+         appended to."""
+        dependency_graph = self.get_dependency_graph()
+        for dependant_id in dependency_graph.get_dependants(
+                image_id=image.get_full_id()):
+            self.components[dependant_id].invalidate_image_layout()
+        for assetpack in self.appended_to:
+            assetpack.invalidate_image(image)
+
+    def get_view(self, desired_projection):
+        """Gets a view of this assetpack projected onto a desired grid size,
+         without changing the assetpack. There is only ever one view for each
+         grid size."""
+        key = (self.projection.width, self.projection.height,
+               desired_projection.width, desired_projection.height)
+        if key not in self.views:
+            self.views[key] = AssetpackView(self, desired_projection)
+        return self.views[key]
 
     def resize_images(self, desired_projection):
         """Accepts a desired grid size definition and uses it to rescale all
          images in the assetpack to match up the grids.
-         Actually scales images at the moment, but could just change scale
-         factors"""
+         This actually resamples every image, so use get_view instead to
+         keep the assetpack usable at its own size."""
         self.projection.resize_images(self.images, desired_projection)
         self.projection.alter_grid_parameters(desired_projection)
 
@@ -157,3 +310,71 @@ class Assetpack:
         co-ordinates used in blueprints."""
         self.projection.rescale_components(self.components, desired_projection)
         self.projection.alter_grid_parameters(desired_projection)
+
+
+class AssetpackView:
+    """
+    An assetpack projected onto a different grid size. Only the scale
+    factors are stored; images are swapped for scaled views of themselves,
+    which are resampled when first rendered and cached for each scale.
+    """
+    def __init__(self, assetpack, desired_projection):
+        self.assetpack = assetpack
+        self.scale_x, self.scale_y = \
+            assetpack.projection.get_grid_ratios(desired_projection)
+        self.projection = type(assetpack.projection)(desired_projection.width,
+                                                     desired_projection.height)
+        # All the assetpack's images, at this grid size.
+        self.images = ScaledImages(self)
+
+    @property
+    def pack_id(self):
+        """The assetpack's ID"""
+        return self.assetpack.pack_id
+
+    @property
+    def components(self):
+        """The assetpack's components, which don't change with grid size"""
+        return self.assetpack.components
+
+    @property
+    def taglist(self):
+        """The assetpack's taglist"""
+        return self.assetpack.taglist
+
+    def get_image(self, image):
+        """Gets the view of an image at this grid size"""
+        return image.scaled(self.scale_x, self.scale_y)
+
+    def get_image_pixel_list(self, grid_offset_x, grid_offset_y,
+                             image_location_list, with_depth=False):
+        """Projects a list of images and grid co-ordinates onto this grid,
+         swapping each image for its view at this grid size."""
+        image_location_list = [(self.get_image(image),) + tuple(location)
+                               for image, *location in image_location_list]
+        return self.projection.get_image_pixel_list(grid_offset_x,
+                                                    grid_offset_y,
+                                                    image_location_list,
+                                                    with_depth)
+
+
+class ScaledImages(Mapping):
+    """
+    A read-only mapping of an assetpack view's image IDs to its images.
+    Images are looked up in the assetpack and swapped for their views at the
+    view's grid size as they're asked for, so nothing is copied.
+    """
+    def __init__(self, view):
+        self.view = view
+
+    def __getitem__(self, image_id):
+        return self.view.get_image(self.view.assetpack.images[image_id])
+
+    def __contains__(self, image_id):
+        return image_id in self.view.assetpack.images
+
+    def __iter__(self):
+        return iter(self.view.assetpack.images)
+
+    def __len__(self):
+        return len(self.view.assetpack.images)
@@ -0,0 +1,118 @@
+"""Functions for rendering lots of components from one assetpack at once,
+spread across a pool of processes."""
+
+from fnmatch import fnmatchcase
+import json
+from multiprocessing import Pool
+import os
+import time
+
+from ddl.assetpack import AssetpackFactory
+from ddl.pack_cache import compile_assetpack, is_cache_fresh
+from ddl.renderer import Renderer
+
+# Each worker process's own assetpack, loaded once when the worker starts.
+WORKER_ASSETPACK = None
+
+
+def read_manifest(manifest_file):
+    """Reads component IDs (or patterns) from a manifest, one per line.
+    Blank lines and lines starting with # are ignored."""
+    component_ids = []
+    for line in manifest_file:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            component_ids.append(line)
+    return component_ids
+
+
+def read_component_ids(path):
+    """Gets an assetpack's ID and the full IDs of its components straight
+    from its JSON files, without loading (or validating) the assetpack."""
+    with open(os.path.join(path, 'pack.json')) as pack_file:
+        pack_id = json.load(pack_file)['id']
+    with open(os.path.join(path, 'components.json')) as components_file:
+        components = json.load(components_file)['components']
+    return (pack_id, [pack_id + '.' + component['id']
+                      for component in components])
+
+
+def match_component_ids(pack_id, all_component_ids, patterns):
+    """
+    Expands a list of component IDs and glob patterns into the full IDs of
+    matching components, in the order given. IDs without an assetpack ID
+    are assumed to belong to the assetpack with the given ID.
+    """
+    component_ids = []
+    seen = set()
+    for pattern in patterns:
+        if '.' not in pattern:
+            pattern = pack_id + '.' + pattern
+        matches = sorted(component_id for component_id in all_component_ids
+                         if fnmatchcase(component_id, pattern))
+        if not matches:
+            raise ValueError(f"No components match '{pattern}'")
+        for component_id in matches:
+            if component_id not in seen:
+                seen.add(component_id)
+                component_ids.append(component_id)
+    return component_ids
+
+
+def render_component(assetpack, component_id, output_directory):
+    """Renders one component to <output_directory>/<component_id>.png and
+    returns the component ID with how long it took in seconds."""
+    start = time.perf_counter()
+    component = assetpack.components[component_id]
+    image_location_list = component.get_image_location_list(0, 0)
+    renderer = Renderer(image_pixel_list=assetpack.projection
+                        .get_image_pixel_list(0, 0, image_location_list))
+    image = renderer.output('variable')
+    image.save(os.path.join(output_directory, component_id + '.png'), 'PNG')
+    return (component_id, time.perf_counter() - start)
+
+
+def load_assetpack(path, shared_pixels):
+    """Loads an assetpack for rendering. Shared pixels come from the
+    compiled cache, otherwise images are decoded as they are needed."""
+    if shared_pixels:
+        return AssetpackFactory.load(path, shared_pixels=True)
+    return AssetpackFactory.load(path, lazy_images=True)
+
+
+def init_worker(path, shared_pixels):
+    """Loads the assetpack once for this worker process"""
+    global WORKER_ASSETPACK
+    WORKER_ASSETPACK = load_assetpack(path, shared_pixels)
+
+
+def render_in_worker(job):
+    """Renders a (component_id, output_directory) job with this worker's
+    assetpack"""
+    component_id, output_directory = job
+    return render_component(WORKER_ASSETPACK, component_id, output_directory)
+
+
+def render_batch(path, component_ids, output_directory, processes=None,
+                 shared_pixels=False):
+    """
+    Renders every component in the list, yielding (component_id, seconds)
+    for each one as it finishes. With a single process everything is
+    rendered here rather than in a pool. With shared_pixels, all the workers
+    memory-map the same compiled copy of the assetpack's pixels.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    if processes == 1:
+        assetpack = load_assetpack(path, shared_pixels)
+        for component_id in component_ids:
+            yield render_component(assetpack, component_id, output_directory)
+        return
+
+    if shared_pixels and not is_cache_fresh(os.path.abspath(path)):
+        # Compile once here, rather than in every worker at once.
+        compile_assetpack(path)
+    jobs = [(component_id, output_directory) for component_id in component_ids]
+    with Pool(processes, initializer=init_worker,
+              initargs=(path, shared_pixels)) as pool:
+        for result in pool.imap_unordered(render_in_worker, jobs):
+            yield result
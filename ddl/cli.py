@@ -1,21 +1,24 @@
 """Contains most of the functions for the CLI. Put here for testing purposes."""
 
 import click
-from PyInquirer import prompt
-import PyInquirer
-import jsonschema
-from ddl.assetpack import AssetpackFactory
-from ddl.validator import Validator
-from ddl.renderer import Renderer
-import ddl.asset_exploration
-from ddl.asset_exploration import explore_assets, show_pack_info, show_projection_info
-import ddl.image_helper
-from ddl.asset import ComponentAsset
-from ddl.cli_utils import *
 import os
+import time
 
-import tkinter as tk
-from PIL import Image, ImageTk
+# Everything else is imported inside the commands that need it, so that
+# non-interactive commands don't pay for (or need) tkinter and PyInquirer.
+
+
+def get_style():
+    """Gets the PyInquirer style shared by all the prompts"""
+    from ddl.cli_utils import STYLE
+    return STYLE
+
+
+def prompt(questions, style):
+    """Asks the user some questions with PyInquirer, which is only imported
+    the first time a question is asked."""
+    from PyInquirer import prompt as inquirer_prompt
+    return inquirer_prompt(questions, style=style)
 
 
 @click.group()
@@ -32,6 +35,9 @@ def validate_assetpack(path):
 
     path: The path of the asset pack directory.
     """
+    import jsonschema
+    from ddl.validator import Validator
+
     pack = False
     images = False
     components = False
@@ -82,6 +88,19 @@ def validate_assetpack(path):
         print("Validation passed. "+path+" is a good assetpack.")
 
 
+@main.command()
+@click.argument('path')
+def compile_assetpack(path):
+    """Compiles an assetpack into a single cache file that loads quickly.
+
+    path: The path of the asset pack directory.
+    """
+    from ddl.pack_cache import compile_assetpack as compile_pack
+
+    cache_path = compile_pack(path)
+    print("Compiled " + path + " to " + cache_path)
+
+
 @main.command()
 @click.argument('path')
 def explore_assetpack(path):
@@ -90,6 +109,10 @@ def explore_assetpack(path):
 
     path: The path of the asset pack directory.
     """
+    from ddl.assetpack import AssetpackFactory
+    from ddl.asset_exploration import explore_assets, show_pack_info,\
+        show_projection_info
+
     path = os.path.abspath(path)
     assetpack = AssetpackFactory.load(path)
     exit_cli = False
@@ -105,7 +128,7 @@ def explore_assetpack(path):
                 'Quit'
             ]
         }]
-        choice = prompt(init, style=STYLE)
+        choice = prompt(init, style=get_style())
         print("")
         option_chosen = choice['choices']
         if option_chosen == 'Quit':
@@ -121,6 +144,8 @@ def explore_assetpack(path):
 
 def validate_component_id(new_id, assetpack):
     """Validates a component ID against the IDS in an assetpack"""
+    import PyInquirer
+
     full_id = assetpack.pack_id + '.' + new_id
     if len(new_id) < 3:
         message = 'Try an ID with more than 2 characters.'
@@ -133,6 +158,8 @@ def validate_component_id(new_id, assetpack):
 
 def add_component(initial_option, component, assetpack):
     """Lets a user choose what they want to see about an asset"""
+    from ddl.cli_utils import check_number
+
     asset_type, asset_key = initial_option.split(': ')
     coordinates_questions = [{
             'type': 'input',
@@ -147,7 +174,7 @@ def add_component(initial_option, component, assetpack):
             'validate': check_number
         }
     ]
-    coordinates = prompt(coordinates_questions, style=STYLE)
+    coordinates = prompt(coordinates_questions, style=get_style())
     component_x = float(coordinates['x'])
     component_y = float(coordinates['y'])
     if asset_type == 'Image':
@@ -164,6 +191,8 @@ def add_component(initial_option, component, assetpack):
 
 def init_component(assetpack, info):
     """Initialise a blank component"""
+    from ddl.asset import ComponentAsset
+
     component_name = info['component_name']
     component_id = info['component_id']
     component_tags = list(map(str.strip, info['component_tags'].split(',')))
@@ -185,7 +214,7 @@ def choose_asset(component, asset_choices, assetpack):
         'name': 'explore',
         'choices': asset_choices
     }]
-    choice = prompt(explore, style=STYLE)
+    choice = prompt(explore, style=get_style())
     print("")
     option_chosen = choice['explore']
     if not option_chosen == 'Back':
@@ -194,11 +223,12 @@ def choose_asset(component, asset_choices, assetpack):
 
 def reset_component_window(component, assetpack, root, old_canvas):
     """clears and redraws the component window"""
+    import tkinter as tk
+    from ddl.render_cache import RENDER_CACHE
+    from ddl.cli_utils import get_rgb_image
+
     component.instantiate_sub_parts()
-    image_location_list = component.get_image_location_list(0, 0)
-    renderer = Renderer(image_pixel_list=assetpack.projection
-                        .get_image_pixel_list(0, 0, image_location_list))
-    orig_image = renderer.output('variable')
+    orig_image = RENDER_CACHE.render(component, assetpack.projection)
     image = get_rgb_image(orig_image)
     canvas = tk.Canvas(width=orig_image.width, height=orig_image.height, bg='white')
     canvas.create_image(0, 0, image=image, anchor=tk.NW)
@@ -233,7 +263,7 @@ def get_initial_component_info(assetpack):
             'name': 'component_tags'
         }
     ]
-    return prompt(component_info, style=STYLE)
+    return prompt(component_info, style=get_style())
 
 
 @main.command()
@@ -244,6 +274,10 @@ def create_new_component(path):
 
     path: The path of the asset pack directory.
     """
+    import tkinter as tk
+    from ddl.assetpack import AssetpackFactory
+    from ddl.cli_utils import get_asset_choices
+
     path = os.path.abspath(path)
     assetpack = AssetpackFactory.load(path)
     info = get_initial_component_info(assetpack)
@@ -260,7 +294,7 @@ def create_new_component(path):
             'name': 'choice',
             'choices': ['Add an asset', 'Done', 'Undo']
         }]
-        choice = prompt(choices, style=STYLE)['choice']
+        choice = prompt(choices, style=get_style())['choice']
         if choice == 'Add an asset':
             choose_asset(component, asset_choices, assetpack)
         elif choice == 'Undo':
@@ -278,7 +312,55 @@ def create_new_component(path):
 @click.option('--height', prompt=True)
 def create_new_images(path, gridtype, width, height):
     """Iterates through all .png images in a directory and lets you set the information for them."""
+    import ddl.image_helper
+    from ddl.cli_utils import check_integer
+
     check_integer(width)
     check_integer(height)
 
     ddl.image_helper.show_directory(path, gridtype, int(height), int(width))
+
+
+@main.command()
+@click.argument('path')
+@click.argument('component_ids', nargs=-1)
+@click.option('--manifest', type=click.File('r'),
+              help='A file listing component IDs or patterns, one per line.')
+@click.option('--output', 'output_directory', default='output',
+              help='The directory to write the PNGs to.')
+@click.option('--processes', type=int, default=None,
+              help='How many render processes to use. Defaults to one per CPU.')
+@click.option('--shared-pixels', is_flag=True,
+              help='Compile the assetpack and share its pixels between processes.')
+def render_batch(path, component_ids, manifest, output_directory, processes,
+                 shared_pixels):
+    """
+    Renders many components to PNGs in parallel, reporting how long each took.
+
+    path: The path of the asset pack directory.
+
+    component_ids: Component IDs or glob patterns, e.g. 'floor-*'.
+    """
+    import ddl.batch_render
+
+    path = os.path.abspath(path)
+    patterns = list(component_ids)
+    if manifest is not None:
+        patterns = patterns + ddl.batch_render.read_manifest(manifest)
+    if not patterns:
+        raise click.UsageError('Give some component IDs or a manifest.')
+
+    # Only the renderers load the assetpack, so it's only validated once.
+    pack_id, all_component_ids = ddl.batch_render.read_component_ids(path)
+    try:
+        full_ids = ddl.batch_render.match_component_ids(
+            pack_id, all_component_ids, patterns)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+
+    start = time.perf_counter()
+    for component_id, seconds in ddl.batch_render.render_batch(
+            path, full_ids, output_directory, processes, shared_pixels):
+        print(f"{component_id}: {seconds:.3f}s")
+    print(f"Rendered {len(full_ids)} components in "
+          f"{time.perf_counter() - start:.3f}s")
@@ -0,0 +1,144 @@
+"""
+Dependency graph
+
+Records which components are built out of which other components and
+images, so components can be checked for missing parts and cycles, laid out
+children first, and invalidated along with everything built from them.
+"""
+
+from ddl.asset_index import split_full_id
+
+
+class MissingPartException(Exception):
+    """Exception class for if a component uses a part that doesn't exist"""
+    pass
+
+
+class ComponentCycleException(Exception):
+    """Exception class for if a component ends up containing itself"""
+    pass
+
+
+class DependencyGraph:
+    """
+    The parts each component uses, and the components that use each part,
+    all by full ID. Component parts and image parts are kept apart, as a
+    component and an image can share an ID.
+    """
+    def __init__(self, components, images):
+        self.components = components
+        self.images = images
+        self.component_parts = {}
+        self.image_parts = {}
+        self.component_dependants = {}
+        self.image_dependants = {}
+        for component in components.values():
+            self.update_component(component)
+
+    def remove_component(self, component_id):
+        """Forgets which parts a component uses"""
+        for part_id in self.component_parts.pop(component_id, ()):
+            self.component_dependants[part_id].discard(component_id)
+        for part_id in self.image_parts.pop(component_id, ()):
+            self.image_dependants[part_id].discard(component_id)
+
+    def update_component(self, component):
+        """Records (again) which parts a component uses"""
+        component_id = component.get_full_id()
+        self.remove_component(component_id)
+        component_parts = set()
+        image_parts = set()
+        for part in component.parts:
+            if part['type'] == 'image':
+                image_parts.add(part['asset_id'])
+            else:
+                component_parts.add(part['asset_id'])
+        self.component_parts[component_id] = component_parts
+        self.image_parts[component_id] = image_parts
+        for part_id in component_parts:
+            self.component_dependants.setdefault(part_id, set())\
+                .add(component_id)
+        for part_id in image_parts:
+            self.image_dependants.setdefault(part_id, set()).add(component_id)
+
+    def get_missing_parts(self):
+        """Gets a (component ID, part ID) pair for every part that isn't in
+         the assetpack"""
+        missing_parts = []
+        for component_id, part_ids in self.component_parts.items():
+            missing_parts.extend((component_id, part_id)
+                                 for part_id in sorted(part_ids)
+                                 if part_id not in self.components)
+        for component_id, part_ids in self.image_parts.items():
+            missing_parts.extend((component_id, part_id)
+                                 for part_id in sorted(part_ids)
+                                 if part_id not in self.images)
+        return missing_parts
+
+    def check_parts(self, pack_id):
+        """Raises a MissingPartException if any component uses a part from
+         the given assetpack that doesn't exist. Parts from other assetpacks
+         can't be checked until those assetpacks are appended."""
+        for component_id, part_id in self.get_missing_parts():
+            if split_full_id(part_id)[0] == pack_id:
+                raise MissingPartException(
+                    'Component {} uses {}, which does not exist.'
+                    .format(component_id, part_id))
+
+    def find_cycle(self, component_ids):
+        """Follows parts from one of a set of components that are all in or
+         behind a cycle until a component repeats, and returns the cycle."""
+        path = []
+        seen = {}
+        component_id = min(component_ids)
+        while component_id not in seen:
+            seen[component_id] = len(path)
+            path.append(component_id)
+            component_id = min(part_id for part_id
+                                in self.component_parts[component_id]
+                                if part_id in component_ids)
+        return path[seen[component_id]:] + [component_id]
+
+    def get_topological_order(self):
+        """
+        Gets the IDs of all the components, each one after all the
+        components it uses. Raises a ComponentCycleException if a component
+        ends up using itself.
+        """
+        waiting_on = {component_id: sum(1 for part_id in part_ids
+                                        if part_id in self.component_parts)
+                      for component_id, part_ids
+                      in self.component_parts.items()}
+        ready = [component_id for component_id, count in waiting_on.items()
+                 if count == 0]
+        order = []
+        while ready:
+            component_id = ready.pop()
+            order.append(component_id)
+            for dependant_id in self.component_dependants.get(component_id,
+                                                              ()):
+                waiting_on[dependant_id] = waiting_on[dependant_id] - 1
+                if waiting_on[dependant_id] == 0:
+                    ready.append(dependant_id)
+        if len(order) != len(self.component_parts):
+            cycle = self.find_cycle({component_id for component_id, count
+                                     in waiting_on.items() if count > 0})
+            raise ComponentCycleException('Components contain themselves: ' +
+                                          ' -> '.join(cycle))
+        return order
+
+    def get_dependants(self, component_id=None, image_id=None):
+        """Gets the IDs of every component built from a component or an
+         image, however indirectly."""
+        if image_id is not None:
+            to_visit = list(self.image_dependants.get(image_id, ()))
+        else:
+            to_visit = list(self.component_dependants.get(component_id, ()))
+        dependants = set()
+        while to_visit:
+            dependant_id = to_visit.pop()
+            if dependant_id not in dependants:
+                dependants.add(dependant_id)
+                to_visit.extend(self.component_dependants.get(dependant_id,
+                                                              ()))
+        return dependants
@@ -0,0 +1,103 @@
+"""
+Image cache
+
+A least-recently-used store for decoded images, bounded by the memory their
+pixels take up rather than by the number of entries.
+"""
+
+from collections import OrderedDict
+
+# 512MiB of decoded pixels before we start throwing things away.
+DEFAULT_BUDGET = 512 * 1024 * 1024
+
+
+class ImageCache:
+    """
+    Stores images against arbitrary keys, evicting the least recently used
+    entries whenever the total size of the stored pixels exceeds the budget.
+    Entries can belong to an owner, so they can all be thrown away once the
+    owner is gone.
+    """
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.used = 0
+        self.entries = OrderedDict()
+        self.owner_keys = {}
+        # Owners that have gone, whose entries haven't been thrown away yet.
+        self.dead_owners = []
+
+    @staticmethod
+    def get_image_bytes(image):
+        """Gets the (approximate) number of bytes an image's pixels take up"""
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, key, loader, owner=None):
+        """
+        Gets the image stored against a key. If there isn't one, calls loader
+        to create it and stores the result before returning it, belonging to
+        owner if there is one.
+        """
+        self.discard_dead_owners()
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+        image = loader()
+        image_bytes = self.get_image_bytes(image)
+        self.entries[key] = (image, image_bytes, owner)
+        self.used = self.used + image_bytes
+        if owner is not None:
+            self.owner_keys.setdefault(owner, set()).add(key)
+        self.evict()
+        return image
+
+    def forget_owner(self, owner):
+        """
+        Marks an owner as gone. Its entries are thrown away the next time the
+        cache is used, which makes this safe to call from a finalizer that
+        might run in the middle of another cache operation.
+        """
+        self.dead_owners.append(owner)
+
+    def discard_dead_owners(self):
+        """Throws away every entry belonging to an owner that has gone"""
+        while self.dead_owners:
+            owner = self.dead_owners.pop()
+            for key in self.owner_keys.pop(owner, ()):
+                self.discard(key)
+
+    def remove_entry(self, key):
+        """Removes an entry, keeping the totals and owners up to date"""
+        _, image_bytes, owner = self.entries.pop(key)
+        self.used = self.used - image_bytes
+        if owner is not None and owner in self.owner_keys:
+            self.owner_keys[owner].discard(key)
+
+    def evict(self):
+        """
+        Throws away the least recently used images until we're back under
+        budget. Never throws away the most recently used image, even if it is
+        bigger than the budget on its own.
+        """
+        while self.used > self.budget and len(self.entries) > 1:
+            self.remove_entry(next(iter(self.entries)))
+
+    def discard(self, key):
+        """Throws away the image stored against a key, if there is one."""
+        if key in self.entries:
+            self.remove_entry(key)
+
+    def set_budget(self, budget):
+        """Changes the memory budget, evicting images if required."""
+        self.budget = budget
+        self.evict()
+
+    def clear(self):
+        """Empties the cache"""
+        self.entries.clear()
+        self.owner_keys.clear()
+        self.dead_owners.clear()
+        self.used = 0
+
+
+# The process-wide cache shared by every ImageAsset.
+IMAGE_CACHE = ImageCache()
@@ -0,0 +1,162 @@
+"""
+Pack cache
+
+Compiles an assetpack into a single cache file holding its validated
+metadata, resolved part IDs and decoded RGBA pixels, laid out so the pixels
+can be used straight out of a memory map.
+
+The file is laid out as:
+    8 bytes     MAGIC
+    8 bytes     the length of the header, little endian
+    header      UTF-8 JSON with the pack, images and components JSON, and
+                the offset, width and height of each image's pixels
+    pixels      raw RGBA pixels for each image, each starting on an
+                ALIGNMENT byte boundary
+"""
+
+import json
+import mmap
+import os
+import struct
+from types import SimpleNamespace
+
+from PIL import Image
+
+from ddl.asset import ComponentAsset, ImageAsset
+from ddl.validator import Validator
+
+MAGIC = b'DDLPACK1'
+ALIGNMENT = 64
+CACHE_FILENAME = 'pack.ddlcache'
+SOURCE_FILENAMES = ['pack.json', 'images.json', 'components.json']
+# The schemas the source files are validated against.
+SCHEMAS = ['pack', 'images', 'components']
+
+
+class PackCacheException(Exception):
+    """Exception class for if a cache file isn't one we can read"""
+    pass
+
+
+def get_cache_path(pack_path):
+    """Gets where the cache file for an assetpack lives"""
+    return os.path.join(pack_path, CACHE_FILENAME)
+
+
+def get_source_mtime(pack_path):
+    """Gets the most recent modification time of any of the files an
+    assetpack is loaded from, including everything under its art directory
+    and the schemas it is validated against"""
+    mtimes = [os.path.getmtime(os.path.join(pack_path, filename))
+              for filename in SOURCE_FILENAMES]
+    mtimes.extend(os.path.getmtime(Validator.get_schema_path(schema))
+                  for schema in SCHEMAS)
+    for directory, _, filenames in os.walk(os.path.join(pack_path, 'art')):
+        # A directory changes when art is added to or removed from it.
+        mtimes.append(os.path.getmtime(directory))
+        mtimes.extend(os.path.getmtime(os.path.join(directory, filename))
+                      for filename in filenames)
+    return max(mtimes)
+
+
+def is_cache_fresh(pack_path):
+    """Checks the assetpack has a cache file newer than all its sources"""
+    cache_path = get_cache_path(pack_path)
+    if not os.path.isfile(cache_path):
+        return False
+    try:
+        return os.path.getmtime(cache_path) > get_source_mtime(pack_path)
+    except FileNotFoundError:
+        return False
+
+
+def align(offset):
+    """Rounds an offset up to the next ALIGNMENT byte boundary"""
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def compile_assetpack(path):
+    """
+    Validates an assetpack, decodes all its images and writes everything
+    into a cache file in the assetpack's directory. Returns the path of the
+    cache file.
+    """
+    pack_path = os.path.abspath(path)
+    pack_json = Validator.validate_file(pack_path + '/pack.json', 'pack')
+    images_json = Validator.validate_file(pack_path + '/images.json',
+                                          'images')
+    components_json = Validator.validate_file(pack_path + '/components.json',
+                                              'components')
+
+    # Resolve the full IDs of all the parts now, so loading doesn't have to.
+    assetpack = SimpleNamespace(pack_id=pack_json['id'])
+    for component in components_json['components']:
+        ComponentAsset(component, assetpack)
+
+    pixel_blobs = []
+    pixels = []
+    for image_data in images_json['images']:
+        image = ImageAsset(image_data, pack_json['id'], pack_path).image
+        pixel_blobs.append(image.tobytes())
+        pixels.append({"width": image.width, "height": image.height})
+
+    # The header's length depends on the offsets, and the offsets depend on
+    # the header's length, so move the pixels along until the header fits in
+    # front of them, then pad the header out to meet them.
+    header = {"pack": pack_json,
+              "images": images_json,
+              "components": components_json,
+              "pixels": pixels}
+    header_start = len(MAGIC) + 8
+    pixels_start = align(header_start)
+    while True:
+        offset = pixels_start
+        for pixel_info, blob in zip(pixels, pixel_blobs):
+            pixel_info["offset"] = offset
+            offset = align(offset + len(blob))
+        header_bytes = json.dumps(header).encode('utf-8')
+        if header_start + len(header_bytes) <= pixels_start:
+            break
+        pixels_start = align(header_start + len(header_bytes))
+    header_size = pixels_start - header_start
+    header_bytes = header_bytes + b' ' * (header_size - len(header_bytes))
+
+    cache_path = get_cache_path(pack_path)
+    # Several processes may compile at once, so never share a temporary file.
+    temporary_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary_path, 'wb') as cache_file:
+        cache_file.write(MAGIC)
+        cache_file.write(struct.pack('<Q', header_size))
+        cache_file.write(header_bytes)
+        for pixel_info, blob in zip(pixels, pixel_blobs):
+            cache_file.seek(pixel_info["offset"])
+            cache_file.write(blob)
+    os.replace(temporary_path, cache_path)
+    return cache_path
+
+
+def load_cache(pack_path):
+    """
+    Loads a cache file, returning the pack, images and components JSON and
+    a list of images (one per entry in the images JSON) whose pixels are
+    read straight from a memory map of the file.
+    """
+    with open(get_cache_path(pack_path), 'rb') as cache_file:
+        pack_map = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if pack_map[:len(MAGIC)] != MAGIC:
+        raise PackCacheException(get_cache_path(pack_path) +
+                                 ' is not a DDL pack cache.')
+    header_start = len(MAGIC) + 8
+    header_size, = struct.unpack('<Q', pack_map[len(MAGIC):header_start])
+    header = json.loads(pack_map[header_start:header_start+header_size]
+                        .decode('utf-8'))
+
+    pixel_view = memoryview(pack_map)
+    images = []
+    for pixel_info in header["pixels"]:
+        size = (pixel_info["width"], pixel_info["height"])
+        start = pixel_info["offset"]
+        end = start + size[0] * size[1] * 4
+        images.append(Image.frombuffer('RGBA', size, pixel_view[start:end],
+                                       'raw', 'RGBA', 0, 1))
+    return (header["pack"], header["images"], header["components"], images)
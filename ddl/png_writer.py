@@ -0,0 +1,88 @@
+"""
+PNG writer
+
+Writes an RGBA PNG a strip of rows at a time, so an image can be saved
+without ever holding all of it in memory.
+"""
+
+import struct
+import zlib
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Compressed data is written out in IDAT chunks of about this many bytes.
+CHUNK_SIZE = 1 << 16
+
+
+class PNGWriter:
+    """
+    Writes rows of an RGBA image of a known size to a binary file as a PNG.
+    Rows aren't filtered, which makes for slightly bigger files but keeps
+    the writer quick. The compression level and strategy are passed straight
+    to zlib.
+    """
+    def __init__(self, file, width, height, compress_level=6,
+                 strategy=zlib.Z_DEFAULT_STRATEGY):
+        self.file = file
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compress_level, zlib.DEFLATED,
+                                           zlib.MAX_WBITS, 9, strategy)
+        self.pending = []
+        self.pending_size = 0
+        self.file.write(SIGNATURE)
+        # 8 bits per channel, colour type 6 (RGBA), no interlacing.
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                              8, 6, 0, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def write_chunk(self, chunk_type, data):
+        """Writes one chunk, with its length and checksum"""
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+    def add_data(self, data):
+        """Queues up compressed data, writing an IDAT chunk when there's
+         enough of it"""
+        if data:
+            self.pending.append(data)
+            self.pending_size = self.pending_size + len(data)
+        if self.pending_size >= CHUNK_SIZE:
+            self.write_chunk(b'IDAT', b''.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+
+    def write_rows(self, image):
+        """Writes all the rows of an RGBA image as the next rows of the
+         PNG. The image must be as wide as the PNG."""
+        if image.mode != 'RGBA' or image.width != self.width:
+            raise ValueError('Rows must be RGBA and {} pixels wide'
+                             .format(self.width))
+        if self.rows_written + image.height > self.height:
+            raise ValueError('Too many rows for a PNG {} pixels high'
+                             .format(self.height))
+        stride = self.width * 4
+        pixels = image.tobytes()
+        # Each row starts with its filter type, which is always 0 (none).
+        rows = b''.join(b'\x00' + pixels[start:start+stride]
+                        for start in range(0, len(pixels), stride))
+        self.add_data(self.compressor.compress(rows))
+        self.rows_written = self.rows_written + image.height
+
+    def close(self):
+        """Finishes the PNG off. Every row has to have been written."""
+        if self.rows_written != self.height:
+            raise ValueError('Only {} of {} rows were written'
+                             .format(self.rows_written, self.height))
+        self.pending.append(self.compressor.flush())
+        self.write_chunk(b'IDAT', b''.join(self.pending))
+        self.pending = []
+        self.write_chunk(b'IEND', b'')
@@ -7,6 +7,7 @@ conversion of co-ordinates to pixel offsets.
 """
 
 import math
+from array import array
 
 
 class Projection:
@@ -30,8 +31,8 @@ class Projection:
     def resize_images(self, images, desired_projection):
         """Accepts a desired grid size definition and uses it to resize all
          images passed in as a dict.
-         Actually scales images at the moment, but could just change scale
-         factors"""
+         Actually scales images. Assetpack.get_view just changes scale
+         factors instead."""
         size_ratio_x, size_ratio_y = self.get_grid_ratios(desired_projection)
         for image in images.values():
             # Time to abuse python's referencing methods.
@@ -59,31 +60,69 @@ class Projection:
             image_offset_y = -image_height+image.top_left["y"]
         return (image_offset_x, image_offset_y)
 
+    def get_image_offsets(self, images, h_flips, v_flips):
+        """Gets the offsets for a sequence of images and their flips, only
+         working out the offset once for each image and flip combination."""
+        offsets = {}
+        image_offsets_x = array('q')
+        image_offsets_y = array('q')
+        for key in zip(images, h_flips, v_flips):
+            offset = offsets.get(key)
+            if offset is None:
+                offset = self.get_image_offset(*key)
+                offsets[key] = offset
+            image_offsets_x.append(offset[0])
+            image_offsets_y.append(offset[1])
+        return (image_offsets_x, image_offsets_y)
+
+    def get_image_pixel_arrays(self, grid_offset_x, grid_offset_y, images,
+                               x_coordinates, y_coordinates, h_flips, v_flips):
+        """Does the work of get_image_pixel_list on equal length sequences
+         of images, grid co-ordinates and flips, returning arrays of pixel x
+         and y co-ordinates. This is still a plain loop per item; it only
+         saves working out the grid offset and each image offset over and
+         over."""
+        pixel_offset_x, pixel_offset_y = self.get_location_in_pixels(
+            grid_offset_x, grid_offset_y)
+        pixel_xs, pixel_ys = self.get_locations_in_pixels(x_coordinates,
+                                                          y_coordinates)
+        image_offsets_x, image_offsets_y = self.get_image_offsets(images,
+                                                                  h_flips,
+                                                                  v_flips)
+        pixel_xs = array('q', [pixel_x+pixel_offset_x+image_offset_x
+                               for pixel_x, image_offset_x
+                               in zip(pixel_xs, image_offsets_x)])
+        pixel_ys = array('q', [pixel_y+pixel_offset_y+image_offset_y
+                               for pixel_y, image_offset_y
+                               in zip(pixel_ys, image_offsets_y)])
+        return (pixel_xs, pixel_ys)
+
     def get_image_pixel_list(self,
                              grid_offset_x,
                              grid_offset_y,
-                             image_location_list):
+                             image_location_list,
+                             with_depth=False):
         """Goes through a list of images and grid co-ordinates and returns a
-         list of images and pixel co-ordinates."""
-        # Worry about performance later.
-        pixel_offsets = self.get_location_in_pixels(grid_offset_x,
-                                                    grid_offset_y)
-        pixel_offset_x, pixel_offset_y = pixel_offsets
-        image_pixel_list = []
-        for info in image_location_list:
-            image, x_coordinate, y_coordinate, h_flip, v_flip = info
-            pixel_x, pixel_y = self.get_location_in_pixels(x_coordinate,
-                                                           y_coordinate)
-
-            image_offset_x, image_offset_y = self.get_image_offset(image,
-                                                                   h_flip,
-                                                                   v_flip)
-            pixel_x = pixel_x+pixel_offset_x+image_offset_x
-            pixel_y = pixel_y+pixel_offset_y+image_offset_y
-
-            next_ipl = [(image, pixel_x, pixel_y, h_flip, v_flip)]
-            image_pixel_list = image_pixel_list+next_ipl
-        return image_pixel_list
+         list of images and pixel co-ordinates. With with_depth, each entry
+         also gets the depth of its grid co-ordinates, so a renderer can
+         paint it in the right order."""
+        if not image_location_list:
+            return []
+        images, x_coordinates, y_coordinates, h_flips, v_flips = \
+            zip(*image_location_list)
+        pixel_xs, pixel_ys = self.get_image_pixel_arrays(grid_offset_x,
+                                                         grid_offset_y,
+                                                         images,
+                                                         x_coordinates,
+                                                         y_coordinates,
+                                                         h_flips,
+                                                         v_flips)
+        if not with_depth:
+            return list(zip(images, pixel_xs, pixel_ys, h_flips, v_flips))
+        depths = self.get_depths(
+            [x_coordinate+grid_offset_x for x_coordinate in x_coordinates],
+            [y_coordinate+grid_offset_y for y_coordinate in y_coordinates])
+        return list(zip(images, pixel_xs, pixel_ys, h_flips, v_flips, depths))
 
 
 class IsometricProjection(Projection):
@@ -97,6 +136,34 @@ class IsometricProjection(Projection):
                   (y_coordinate*math.floor(self.height/2))
         return (round(pixel_x), round(pixel_y))
 
+    def get_locations_in_pixels(self, x_coordinates, y_coordinates):
+        """get_location_in_pixels for an isometric grid, over equal length
+        sequences of grid co-ordinates, returning arrays of pixel
+        co-ordinates rounded the same way. The half cell sizes are only
+        worked out once, but each co-ordinate is still converted in Python."""
+        half_width_ceil = math.ceil(self.width/2)
+        half_width_floor = math.floor(self.width/2)
+        half_height_ceil = math.ceil(self.height/2)
+        half_height_floor = math.floor(self.height/2)
+        pixel_xs = array('q', [round((x_coordinate*half_width_ceil) -
+                                     (y_coordinate*half_width_floor))
+                               for x_coordinate, y_coordinate
+                               in zip(x_coordinates, y_coordinates)])
+        pixel_ys = array('q', [round((x_coordinate*half_height_ceil) +
+                                     (y_coordinate*half_height_floor))
+                               for x_coordinate, y_coordinate
+                               in zip(x_coordinates, y_coordinates)])
+        return (pixel_xs, pixel_ys)
+
+    @staticmethod
+    def get_depths(x_coordinates, y_coordinates):
+        """Gets how far back each grid co-ordinate is. Things further back
+        should be painted first, and on an isometric grid that is whatever
+        has the smallest x+y."""
+        return [x_coordinate+y_coordinate
+                for x_coordinate, y_coordinate
+                in zip(x_coordinates, y_coordinates)]
+
 
 class TopDownProjection(Projection):
     """A TopDown Projection subclass to overload how pixel offsets
@@ -106,3 +173,23 @@ class TopDownProjection(Projection):
         pixel_x = x_coordinate*self.width
         pixel_y = y_coordinate*self.height
         return (round(pixel_x), round(pixel_y))
+
+    def get_locations_in_pixels(self, x_coordinates, y_coordinates):
+        """get_location_in_pixels for a cartesian grid, over equal length
+        sequences of grid co-ordinates, returning arrays of pixel
+        co-ordinates rounded the same way. Each co-ordinate is still
+        converted in Python."""
+        width = self.width
+        height = self.height
+        pixel_xs = array('q', [round(x_coordinate*width)
+                               for x_coordinate in x_coordinates])
+        pixel_ys = array('q', [round(y_coordinate*height)
+                               for y_coordinate in y_coordinates])
+        return (pixel_xs, pixel_ys)
+
+    @staticmethod
+    def get_depths(x_coordinates, y_coordinates):
+        """Gets how far back each grid co-ordinate is. Things further back
+        should be painted first, and on a cartesian grid that is whatever
+        is nearest the top."""
+        return list(y_coordinates)
@@ -0,0 +1,66 @@
+"""
+Render cache
+
+Keeps finished renders of components, so showing the same component again
+doesn't render it all over again.
+"""
+
+from ddl.image_cache import ImageCache
+from ddl.renderer import Renderer
+
+# 128MiB of rendered components before we start throwing things away.
+RENDER_BUDGET = 128 * 1024 * 1024
+
+
+def get_layout_key(component):
+    """
+    Gets everything that decides what a component looks like, as a tuple:
+    where each of its images goes, how it's flipped, and which file,
+    version, size and offsets of the image are used. The tuple itself is
+    part of the cache key, so two different layouts can never be confused.
+    """
+    return tuple((image.get_full_id(), image.path, image.image_version,
+                  image.get_image_sizes(),
+                  image.top_left["x"], image.top_left["y"],
+                  x_coordinate, y_coordinate, h_flip, v_flip)
+                 for image, x_coordinate, y_coordinate, h_flip, v_flip
+                 in component.get_image_layout())
+
+
+def get_render_key(component, projection):
+    """Gets the key a component rendered in a projection is cached under"""
+    return (component.get_full_id(), type(projection).__name__,
+            projection.width, projection.height, get_layout_key(component))
+
+
+class RenderCache(ImageCache):
+    """
+    A least-recently-used cache of rendered components. Renders are keyed by
+    the component's contents as well as its ID, so a changed component is
+    always rendered again. Renders are shared, so don't draw on them.
+    """
+    def __init__(self, budget=RENDER_BUDGET):
+        super().__init__(budget)
+
+    def render(self, component, projection):
+        """Gets a component rendered in a projection, only rendering it if
+         it hasn't been rendered like this before."""
+        def render_component():
+            """Renders the component from scratch"""
+            image_location_list = component.get_image_location_list(0, 0)
+            renderer = Renderer(image_pixel_list=projection
+                                .get_image_pixel_list(0, 0,
+                                                      image_location_list))
+            return renderer.output('variable')
+
+        return self.get(get_render_key(component, projection),
+                        render_component)
+
+    def forget_component(self, component_id):
+        """Throws away every render of a component, given its full ID"""
+        for key in [key for key in self.entries if key[0] == component_id]:
+            self.discard(key)
+
+
+# The process-wide cache of rendered components.
+RENDER_CACHE = RenderCache()
@@ -5,20 +5,46 @@ Handle assembling an output image, any chrome, and displaying/saving
 accordingly.
 """
 
+from operator import itemgetter
+import os
 import random
 import string
+import zlib
 
 from PIL import Image
 
+from ddl.png_writer import PNGWriter
+from ddl.projection import Projection
+from ddl.spatial_index import GridIndex
+
+FILE_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp'}
+# Formats that can't store an alpha channel.
+OPAQUE_FORMATS = ['JPEG', 'BMP']
+
 
 class Renderer:
     """This class renders lists of images and their pixel locations."""
-    def __init__(self, image_pixel_list=None):
+    def __init__(self, image_pixel_list=None, depth_sort=False, cull=False,
+                 scale=1):
         self.min_x = 0
         self.min_y = 0
         self.max_x = 0
         self.max_y = 0
         self.image_pixel_list = []
+        # Every image pixel list entry, bucketed by where it lands in pixels.
+        self.spatial_index = GridIndex()
+        # The order key of the first entry in image_pixel_list. Batches are
+        # added to the front of the list, so these count down.
+        self.first_order = 0
+        # With depth sorting, images are painted by layer, then by the depth
+        # of their grid co-ordinates, and only then in list order.
+        self.depth_sort = depth_sort
+        self.order_keys = []
+        self.painting_order = None
+        # Whether to skip images that later opaque images completely cover.
+        self.cull = cull
+        # How much bigger or smaller than the images the output should be.
+        self.scale = scale
         if image_pixel_list is not None:
             self.add_image_pixel_list(image_pixel_list)
 
@@ -26,28 +52,88 @@ class Renderer:
         """Set up a clean image"""
         self.image = Image.new('RGBA', (width, height), (255, 0, 0, 0))
 
-    def add_image_pixel_list(self, image_pixel_list):
+    def add_image_pixel_list(self, image_pixel_list, layer=0):
         """Add some images at some series of offsets to the list of images to
-         be rendered"""
+         be rendered. When depth sorting, entries may carry their depth as a
+         sixth item, and anything in a higher layer is painted on top."""
+        if self.scale != 1:
+            image_pixel_list = self.scale_image_pixel_list(image_pixel_list)
+        order = self.first_order - len(image_pixel_list)
+        self.first_order = order
         for info in image_pixel_list:
             sub_image, pixel_x, pixel_y = info[:3]
             min_x, min_y, max_x, max_y = \
                 self.get_image_pixel_boundaries(sub_image, pixel_x, pixel_y)
+            order_key = self.get_order_key(info, layer, order)
+            self.spatial_index.insert(order_key,
+                                      (min_x, min_y, max_x, max_y),
+                                      info)
+            self.order_keys.append((order_key, info))
+            order = order + 1
             self.min_x = min(min_x, self.min_x)
             self.min_y = min(min_y, self.min_y)
             self.max_x = max(max_x, self.max_x)
             self.max_y = max(max_y, self.max_y)
 
         self.image_pixel_list = image_pixel_list+self.image_pixel_list
+        self.painting_order = None
+
+    def scale_image_pixel_list(self, image_pixel_list):
+        """
+        Swaps every image in an image pixel list for a view of it at this
+        renderer's scale, and moves it so the point it is anchored to on the
+        grid is scaled too. Each image and flip's offsets are only worked out
+        once.
+        """
+        offsets = {}
+        scaled_list = []
+        for info in image_pixel_list:
+            sub_image, pixel_x, pixel_y, h_flip, v_flip = info[:5]
+            key = (sub_image, h_flip, v_flip)
+            if key not in offsets:
+                scaled_image = sub_image.scaled(self.scale)
+                offsets[key] = (scaled_image,
+                                Projection.get_image_offset(sub_image, h_flip,
+                                                            v_flip),
+                                Projection.get_image_offset(scaled_image,
+                                                            h_flip, v_flip))
+            scaled_image, offset, scaled_offset = offsets[key]
+            scaled_x = round((pixel_x-offset[0])*self.scale)+scaled_offset[0]
+            scaled_y = round((pixel_y-offset[1])*self.scale)+scaled_offset[1]
+            scaled_list.append((scaled_image, scaled_x, scaled_y, h_flip,
+                                v_flip) + tuple(info[5:]))
+        return scaled_list
+
+    def get_order_key(self, info, layer, order):
+        """Gets the key images are painted in order of. Without depth
+         sorting, this is just their position in the image pixel list."""
+        if not self.depth_sort:
+            return order
+        depth = info[5] if len(info) > 5 else 0
+        return (layer, depth, order)
+
+    def get_painting_order(self):
+        """Gets the image pixel list in the order it should be painted. The
+         sort is stable and only redone after more images are added."""
+        if not self.depth_sort:
+            return self.image_pixel_list
+        if self.painting_order is None:
+            self.painting_order = [info for _, info in
+                                   sorted(self.order_keys, key=itemgetter(0))]
+        return self.painting_order
 
     def add_to_image(self, sub_image, pixel_x, pixel_y, h_flip, v_flip):
         """Adds all images to the final picture, taking into account their
-         top-left corner offsets"""
-        final_x = pixel_x
-        final_y = pixel_y
-        # second image.image call is alpha mask.
-        image = sub_image.get_image(h_flip, v_flip)
-        self.image.paste(image, (final_x, final_y), image)
+         top-left corner offsets. Transparent margins are never pasted, and
+         each image is pasted with the cheapest mask that gives the same
+         result."""
+        image, offset_x, offset_y, mask = sub_image.get_paste_info(h_flip,
+                                                                   v_flip)
+        if image is None:
+            return
+        final_x = pixel_x + offset_x
+        final_y = pixel_y + offset_y
+        self.image.paste(image, (final_x, final_y), mask)
 
     @staticmethod
     def get_image_pixel_boundaries(sub_image, pixel_x, pixel_y):
@@ -59,32 +145,205 @@ class Renderer:
         max_y = min_y+image_height
         return (min_x, min_y, max_x, max_y)
 
+    def get_canvas_size(self):
+        """Gets the width and height of the final image, including margins"""
+        return (self.max_x - self.min_x + 20, self.max_y - self.min_y + 20)
+
+    def cull_hidden_images(self, image_pixel_list, left, top, right, bottom):
+        """
+        Goes backwards through a list of images in painting order, keeping
+        track of the opaque rectangles of the images already kept. Returns
+        the list without any images whose visible pixels within a box on the
+        final image all lie under one of those rectangles, so the output
+        doesn't change. Only rectangles are compared, so this costs far less
+        than the pastes it saves, but images covered by several others
+        together are still pasted.
+        """
+        occluders = GridIndex()
+        visible_images = []
+        for info in reversed(image_pixel_list):
+            sub_image, pixel_x, pixel_y, h_flip, v_flip = info[:5]
+            visible_box = sub_image.get_visible_box(h_flip, v_flip)
+            if visible_box is None:
+                continue
+            box_x = pixel_x-self.min_x+10-left
+            box_y = pixel_y-self.min_y+10-top
+            # Only the part of the image within the box matters.
+            min_x = max(box_x+visible_box[0], 0)
+            min_y = max(box_y+visible_box[1], 0)
+            max_x = min(box_x+visible_box[2], right-left)
+            max_y = min(box_y+visible_box[3], bottom-top)
+            if min_x >= max_x or min_y >= max_y or\
+                    occluders.contains(min_x, min_y, max_x, max_y):
+                continue
+            visible_images.append(info)
+            opaque_box = sub_image.get_opaque_box(h_flip, v_flip)
+            if opaque_box is not None:
+                occluders.insert(len(visible_images),
+                                 (box_x+opaque_box[0], box_y+opaque_box[1],
+                                  box_x+opaque_box[2], box_y+opaque_box[3]),
+                                 info)
+        visible_images.reverse()
+        return visible_images
+
     def assemble(self):
         """Add all images in the list to the final image."""
-        image_pixel_width = self.max_x - self.min_x + 20
-        image_pixel_height = self.max_y - self.min_y + 20
+        image_pixel_width, image_pixel_height = self.get_canvas_size()
         self.initialise_image(image_pixel_width, image_pixel_height)
-        for info in self.image_pixel_list:
-            sub_image, pixel_x, pixel_y, h_flip, v_flip = info
+        image_pixel_list = self.get_painting_order()
+        if self.cull:
+            image_pixel_list = self.cull_hidden_images(image_pixel_list, 0, 0,
+                                                       image_pixel_width,
+                                                       image_pixel_height)
+        for info in image_pixel_list:
+            sub_image, pixel_x, pixel_y, h_flip, v_flip = info[:5]
             self.add_to_image(sub_image,
                               pixel_x-self.min_x+10,
                               pixel_y-self.min_y+10,
                               h_flip,
                               v_flip)
 
-    def output(self, destination, filename=None):
-        """Actually put the image somewhere"""
+    def get_images_in_viewport(self, min_x, min_y, max_x, max_y):
+        """Gets the entries of the image pixel list that overlap a box, given
+         in the same pixel co-ordinates as the list itself, in the order they
+         should be painted."""
+        return self.spatial_index.query(min_x, min_y, max_x, max_y)
+
+    def get_images_in_region(self, left, top, right, bottom):
+        """Gets the entries of the image pixel list that overlap a box on the
+         final image, in the order they should be painted."""
+        offset_x = self.min_x - 10
+        offset_y = self.min_y - 10
+        return self.get_images_in_viewport(left+offset_x, top+offset_y,
+                                           right+offset_x, bottom+offset_y)
+
+    def assemble_region(self, left, top, right, bottom):
+        """Add only the images that overlap a box on the final image to a new
+         image the size of that box."""
+        self.initialise_image(right-left, bottom-top)
+        image_pixel_list = self.get_images_in_region(left, top, right, bottom)
+        if self.cull:
+            image_pixel_list = self.cull_hidden_images(image_pixel_list, left,
+                                                       top, right, bottom)
+        for info in image_pixel_list:
+            sub_image, pixel_x, pixel_y, h_flip, v_flip = info[:5]
+            self.add_to_image(sub_image,
+                              pixel_x-self.min_x+10-left,
+                              pixel_y-self.min_y+10-top,
+                              h_flip,
+                              v_flip)
+        return self.image
+
+    def get_tiles(self, tile_size):
+        """Renders the final image one square tile at a time, yielding the
+         column, row and image of each tile. Only one tile is held in memory
+         at once."""
+        width, height = self.get_canvas_size()
+        for row, top in enumerate(range(0, height, tile_size)):
+            bottom = min(top+tile_size, height)
+            for column, left in enumerate(range(0, width, tile_size)):
+                right = min(left+tile_size, width)
+                yield (column, row,
+                       self.assemble_region(left, top, right, bottom))
+
+    def output_tiles(self, directory, tile_size):
+        """Saves the final image as a directory of tiles, named
+         <column>_<row>.png"""
+        os.makedirs(directory, exist_ok=True)
+        for column, row, tile in self.get_tiles(tile_size):
+            tile.save(os.path.join(directory, f"{column}_{row}.png"), "PNG")
+
+    @staticmethod
+    def get_random_filename():
+        """Makes up a random name for an output file"""
+        return ''.join([random.SystemRandom()
+                       .choice(string.ascii_lowercase)
+                       for n in range(8)])
+
+    @staticmethod
+    def get_file_extension(image_format):
+        """Gets the usual file extension for an image format"""
+        return FILE_EXTENSIONS.get(image_format, image_format.lower())
+
+    @staticmethod
+    def save_image(image, file, image_format='PNG', compress_level=None,
+                   compress_strategy=None):
+        """
+        Saves an image to a path or binary file object in the given format.
+        compress_level trades speed for size when saving PNGs, from 0 (no
+        compression) to 9 (smallest), and compress_strategy picks a zlib
+        strategy such as zlib.Z_RLE. Formats that can't store transparency
+        get the image flattened onto white first.
+        """
+        save_options = {}
+        if compress_level is not None and image_format == 'PNG':
+            save_options['compress_level'] = compress_level
+        if compress_strategy is not None and image_format == 'PNG':
+            save_options['compress_type'] = compress_strategy
+        if image_format in OPAQUE_FORMATS:
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, (0, 0), image)
+            image = background
+        image.save(file, image_format, **save_options)
+
+    def output_stream(self, file, strip_height=256, compress_level=6,
+                      compress_strategy=zlib.Z_DEFAULT_STRATEGY):
+        """
+        Saves the final image as a PNG to a path or binary file object,
+        rendering and compressing it one full width strip at a time. Only
+        one strip is ever held in memory.
+        """
+        width, height = self.get_canvas_size()
+        if isinstance(file, str):
+            with open(file, 'wb') as png_file:
+                self.output_stream(png_file, strip_height, compress_level,
+                                   compress_strategy)
+            return
+        with PNGWriter(file, width, height, compress_level,
+                       compress_strategy) as writer:
+            for top in range(0, height, strip_height):
+                bottom = min(top+strip_height, height)
+                writer.write_rows(self.assemble_region(0, top, width, bottom))
+
+    def output(self, destination, filename=None, tile_size=1024, file=None,
+               image_format='PNG', compress_level=None, strip_height=256,
+               compress_strategy=None):
+        """
+        Actually put the image somewhere. Files are saved to file, which may
+        be a path or a binary file object, or to output/<filename> if it
+        isn't given. 'stream' saves a PNG a strip at a time rather than
+        assembling the whole image first.
+        """
+
+        if destination == 'tiles':
+            # Tiles are rendered one at a time rather than assembled.
+            if not filename:
+                filename = self.get_random_filename()
+            self.output_tiles('output/' + filename, tile_size)
+            return
+        if destination == 'stream' and image_format != 'PNG':
+            raise ValueError('Only PNGs can be streamed')
+        if destination in ['file', 'stream'] and file is None:
+            if not filename:
+                filename = self.get_random_filename()
+            file = 'output/' + filename + '.' +\
+                self.get_file_extension(image_format)
+        if destination == 'stream':
+            if compress_level is None:
+                compress_level = 6
+            if compress_strategy is None:
+                compress_strategy = zlib.Z_DEFAULT_STRATEGY
+            self.output_stream(file, strip_height, compress_level,
+                               compress_strategy)
+            return
 
         self.assemble()
 
         if destination == 'screen':
             self.image.show()
         elif destination == 'file':
-            if not filename:
-                filename = ''.join([random.SystemRandom()
-                                   .choice(string.ascii_lowercase)
-                                   for n in range(8)])
-            self.image.save('output/' + filename + ".png", "PNG")
+            self.save_image(self.image, file, image_format, compress_level,
+                            compress_strategy)
         elif destination == 'variable':
             return self.image
         elif destination == 'dryrun':
@@ -0,0 +1,65 @@
+"""
+Spatial index
+
+Buckets boxes into a grid of square cells, so everything overlapping a
+rectangle can be found without looking at everything.
+"""
+
+
+class GridIndex:
+    """
+    A grid of buckets. Each item is stored in every cell its box touches,
+    along with an order key so that queries can hand items back in the
+    order they were meant to be painted.
+    """
+    def __init__(self, cell_size=256):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.size = 0
+
+    def get_cells(self, min_x, min_y, max_x, max_y):
+        """Gets the co-ordinates of all the cells a box touches"""
+        cell_size = self.cell_size
+        # Boxes include their minimum but not their maximum co-ordinates.
+        first_column = min_x // cell_size
+        last_column = (max_x - 1) // cell_size
+        first_row = min_y // cell_size
+        last_row = (max_y - 1) // cell_size
+        return [(column, row)
+                for column in range(first_column, last_column + 1)
+                for row in range(first_row, last_row + 1)]
+
+    def insert(self, order, box, item):
+        """Adds an item with a given (min_x, min_y, max_x, max_y) box"""
+        entry = (order, box, item)
+        for cell in self.get_cells(*box):
+            self.cells.setdefault(cell, []).append(entry)
+        self.size = self.size + 1
+
+    def query(self, min_x, min_y, max_x, max_y):
+        """Gets all the items whose boxes overlap the given box, sorted by
+        their order keys."""
+        found = {}
+        for cell in self.get_cells(min_x, min_y, max_x, max_y):
+            for entry in self.cells.get(cell, ()):
+                order, box, _ = entry
+                if order not in found and box[0] < max_x and\
+                        box[2] > min_x and box[1] < max_y and box[3] > min_y:
+                    found[order] = entry
+        return [found[order][2] for order in sorted(found)]
+
+    def contains(self, min_x, min_y, max_x, max_y):
+        """Checks whether any one item's box covers the whole of the given
+        box. Such a box has to cover the given box's first corner, so only
+        the cell that corner is in needs looking at."""
+        cell = (min_x // self.cell_size, min_y // self.cell_size)
+        for _, box, _ in self.cells.get(cell, ()):
+            if box[0] <= min_x and box[1] <= min_y and\
+                    box[2] >= max_x and box[3] >= max_y:
+                return True
+        return False
+
+    def clear(self):
+        """Empties the index"""
+        self.cells = {}
+        self.size = 0
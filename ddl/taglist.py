@@ -1,17 +1,269 @@
 """Adds a class to store and retrieve names of components, given their tags"""
 
+from collections import OrderedDict
+from collections.abc import Set
+import random
+
+# How many tag expressions' samplers to keep at once.
+SAMPLER_CACHE_SIZE = 256
+
+
+def count_bits(bits):
+    """Counts how many bits are set in a bitset"""
+    return bin(bits).count('1')
+
+
+class ComponentSet(Set):
+    """
+    A read-only set of component IDs, backed by a bitset over a taglist's
+    component indices. Nothing is copied until it is iterated over. The set
+    always holds the components that matched when it was made, as the
+    taglist copies its IDs before removing or reusing any of them.
+    """
+    def __init__(self, taglist, bits):
+        self.component_ids = taglist.component_ids
+        self.component_indices = taglist.component_indices
+        taglist.ids_shared = True
+        self.bits = bits
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        """Set operations with other sets give plain frozensets"""
+        return frozenset(iterable)
+
+    def __contains__(self, component_id):
+        index = self.component_indices.get(component_id)
+        return index is not None and bool(self.bits >> index & 1)
+
+    def __iter__(self):
+        component_ids = self.component_ids
+        bits = self.bits
+        while bits:
+            lowest_bit = bits & -bits
+            yield component_ids[lowest_bit.bit_length() - 1]
+            bits = bits ^ lowest_bit
+
+    def __len__(self):
+        return count_bits(self.bits)
+
+    def __repr__(self):
+        return 'ComponentSet({})'.format(set(self))
+
+
+class ComponentSampler:
+    """
+    Picks component IDs at random in constant time, either uniformly or in
+    proportion to their weights. Weighted picks use an alias table, built
+    with Vose's method.
+    """
+    def __init__(self, component_ids, weights=None):
+        self.component_ids = component_ids
+        self.probabilities = None
+        self.aliases = None
+        if weights is not None:
+            self.build_alias_table(weights)
+
+    def build_alias_table(self, weights):
+        """Splits the weights into equal columns, each holding at most two
+         components: itself, and an alias that tops it up."""
+        count = len(weights)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        self.probabilities = [1.0] * count
+        self.aliases = list(range(count))
+        small = [index for index, weight in enumerate(scaled) if weight < 1]
+        large = [index for index, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            small_index = small.pop()
+            large_index = large.pop()
+            self.probabilities[small_index] = scaled[small_index]
+            self.aliases[small_index] = large_index
+            scaled[large_index] = scaled[large_index] + scaled[small_index] - 1
+            if scaled[large_index] < 1:
+                small.append(large_index)
+            else:
+                large.append(large_index)
+        # Anything left over is (give or take rounding) exactly one column.
+
+    def sample(self, rng=random):
+        """Picks a component ID"""
+        index = int(rng.random() * len(self.component_ids))
+        if self.aliases is not None and\
+                rng.random() >= self.probabilities[index]:
+            index = self.aliases[index]
+        return self.component_ids[index]
+
+
+class Tag:
+    """A tag expression matching every component with a tag"""
+    def __init__(self, tag):
+        self.tag = tag
+
+    def get_key(self):
+        """Gets a hashable key that is the same for equivalent expressions"""
+        return ('tag', self.tag)
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def estimate(self, taglist):
+        """Gets (at most) how many components this could match"""
+        return taglist.tag_counts.get(self.tag, 0)
+
+    def evaluate(self, taglist):
+        """Gets the bitset of components this matches"""
+        return taglist.tag_bits.get(self.tag, 0)
+
+
+class And(Tag):
+    """A tag expression matching components that match all its parts.
+     The parts likely to match least are worked out first, and nothing else
+     is worked out once nothing matches."""
+    def __init__(self, *expressions):
+        self.expressions = expressions
+
+    def get_key(self):
+        """Gets a hashable key that is the same for equivalent expressions"""
+        return ('and',) + tuple(expression.get_key()
+                                for expression in self.expressions)
+
+    def estimate(self, taglist):
+        """Gets (at most) how many components this could match"""
+        return min((expression.estimate(taglist)
+                    for expression in self.expressions),
+                   default=len(taglist.component_ids))
+
+    def evaluate(self, taglist):
+        """Gets the bitset of components this matches"""
+        expressions = sorted(self.expressions,
+                             key=lambda expression:
+                             expression.estimate(taglist))
+        bits = taglist.all_bits
+        for expression in expressions:
+            bits = bits & expression.evaluate(taglist)
+            if not bits:
+                break
+        return bits
+
+
+class Or(Tag):
+    """A tag expression matching components that match any of its parts"""
+    def __init__(self, *expressions):
+        self.expressions = expressions
+
+    def get_key(self):
+        """Gets a hashable key that is the same for equivalent expressions"""
+        return ('or',) + tuple(expression.get_key()
+                               for expression in self.expressions)
+
+    def estimate(self, taglist):
+        """Gets (at most) how many components this could match"""
+        return min(sum(expression.estimate(taglist)
+                       for expression in self.expressions),
+                   len(taglist.component_ids))
+
+    def evaluate(self, taglist):
+        """Gets the bitset of components this matches"""
+        bits = 0
+        for expression in self.expressions:
+            bits = bits | expression.evaluate(taglist)
+        return bits
+
+
+class Not(Tag):
+    """A tag expression matching components that don't match its part"""
+    def __init__(self, expression):
+        self.expression = expression
+
+    def get_key(self):
+        """Gets a hashable key that is the same for equivalent expressions"""
+        return ('not', self.expression.get_key())
+
+    def estimate(self, taglist):
+        """Gets (at most) how many components this could match"""
+        return len(taglist.component_ids)
+
+    def evaluate(self, taglist):
+        """Gets the bitset of components this matches"""
+        return taglist.all_bits & ~self.expression.evaluate(taglist)
+
 
 class TagList:
     """
     A class that stores and retrieves names of components given their
     tag lists. Basically a fancy lookup class for faster/easier tag handling.
+    Each component is given a small integer index, and each tag is stored as
+    a bitset of the indices of the components that have it. Indices freed up
+    by removing components are given out again.
     """
     def __init__(self):
-        self.tag_components = {}
+        # Removed components leave None behind until their index is reused.
+        self.component_ids = []
+        self.component_indices = {}
+        self.component_tags = []
+        self.free_indices = []
+        # Whether any ComponentSet is looking at component_ids and
+        # component_indices, so they must be copied before IDs are removed,
+        # renamed or reused.
+        self.ids_shared = False
+        self.tag_bits = {}
+        self.tag_counts = {}
+        self.all_bits = 0
+        self.component_weights = []
+        # Samplers for recently sampled expressions, thrown away whenever
+        # anything changes.
+        self.samplers = OrderedDict()
+
+    @property
+    def tag_components(self):
+        """The set of components with each tag"""
+        return {tag: ComponentSet(self, bits)
+                for tag, bits in self.tag_bits.items()}
+
+    def unshare_ids(self):
+        """Copies the component IDs and indices if any ComponentSet is
+         looking at them, so changing them doesn't change those sets."""
+        if self.ids_shared:
+            self.component_ids = list(self.component_ids)
+            self.component_indices = dict(self.component_indices)
+            self.ids_shared = False
+
+    def get_index(self, component_id):
+        """Gets a component's index, giving it the next one if it's new"""
+        index = self.component_indices.get(component_id)
+        if index is None:
+            if self.free_indices:
+                self.unshare_ids()
+                index = self.free_indices.pop()
+                self.component_ids[index] = component_id
+                self.component_weights[index] = 1
+                self.component_tags[index] = set()
+            else:
+                index = len(self.component_ids)
+                self.component_ids.append(component_id)
+                self.component_weights.append(1)
+                self.component_tags.append(set())
+            self.component_indices[component_id] = index
+            self.all_bits = self.all_bits | 1 << index
+            self.samplers.clear()
+        return index
 
     def add_component_to_tag(self, tag, component_id):
         """Adds a component ID to the list of components matching a tag"""
-        self.tag_components.setdefault(tag, set()).add(component_id)
+        index = self.get_index(component_id)
+        bit = 1 << index
+        bits = self.tag_bits.get(tag, 0)
+        if not bits & bit:
+            self.component_tags[index].add(tag)
+            self.tag_bits[tag] = bits | bit
+            self.tag_counts[tag] = self.tag_counts.get(tag, 0) + 1
+            self.samplers.clear()
 
     def add_component(self, component):
         """
@@ -19,28 +271,126 @@ class TagList:
         component's tags.
         """
         component_id = component.get_full_id()
+        self.set_weight(component_id, getattr(component, 'weight', 1))
         for tag in component.tags:
             self.add_component_to_tag(tag, component_id)
 
+    def set_weight(self, component_id, weight):
+        """Sets how likely a component is to be picked, relative to others"""
+        if weight < 0:
+            raise ValueError('Component weights cannot be negative')
+        index = self.get_index(component_id)
+        if self.component_weights[index] != weight:
+            self.component_weights[index] = weight
+            self.samplers.clear()
+
+    def remove_component(self, component_id):
+        """Takes a component out of every tag it has, given its full ID"""
+        self.unshare_ids()
+        index = self.component_indices.pop(component_id)
+        bit = 1 << index
+        for tag in self.component_tags[index]:
+            bits = self.tag_bits[tag] & ~bit
+            if bits:
+                self.tag_bits[tag] = bits
+                self.tag_counts[tag] = self.tag_counts[tag] - 1
+            else:
+                del self.tag_bits[tag]
+                del self.tag_counts[tag]
+        self.component_ids[index] = None
+        self.component_weights[index] = 0
+        self.component_tags[index] = set()
+        self.all_bits = self.all_bits & ~bit
+        self.free_indices.append(index)
+        self.samplers.clear()
+
+    def rename_component(self, component_id, new_component_id):
+        """Changes a component's full ID, keeping all its tags"""
+        if new_component_id == component_id:
+            return
+        if new_component_id in self.component_indices:
+            raise ValueError('The key %s is already in use' %
+                             new_component_id)
+        self.unshare_ids()
+        index = self.component_indices.pop(component_id)
+        self.component_ids[index] = new_component_id
+        self.component_indices[new_component_id] = index
+        self.samplers.clear()
+
     def append(self, taglist):
-        """Sticks two taglists together"""
-        tag_components = taglist.tag_components
-        for tag, components in tag_components.items():
-            self.tag_components.setdefault(tag,
-                                           set()).update(components)
+        """Sticks two taglists together. If none of the other taglist's
+         components are in this one, its indices and bitsets are just shifted
+         along, which only costs as much as the other taglist is big."""
+        if any(component_id in self.component_indices
+               for component_id in taglist.component_indices):
+            for component_id, index in taglist.component_indices.items():
+                self.set_weight(component_id,
+                                taglist.component_weights[index])
+                for tag in taglist.component_tags[index]:
+                    self.add_component_to_tag(tag, component_id)
+            return
+        offset = len(self.component_ids)
+        self.component_ids.extend(taglist.component_ids)
+        self.component_weights.extend(taglist.component_weights)
+        self.component_tags.extend(set(tags)
+                                   for tags in taglist.component_tags)
+        for component_id, index in taglist.component_indices.items():
+            self.component_indices[component_id] = index + offset
+        self.free_indices.extend(index + offset
+                                 for index in taglist.free_indices)
+        self.all_bits = self.all_bits | taglist.all_bits << offset
+        for tag, bits in taglist.tag_bits.items():
+            self.tag_bits[tag] = self.tag_bits.get(tag, 0) | bits << offset
+            self.tag_counts[tag] = self.tag_counts.get(tag, 0) +\
+                taglist.tag_counts[tag]
+        self.samplers.clear()
+
+    def query(self, expression):
+        """Gets the set of components matching a tag expression, made from
+         Tag, And, Or and Not"""
+        return ComponentSet(self, expression.evaluate(self))
 
     def get_components_that_match_tags(self, tags):
         """
         For an array of tags, goes through and finds the ID of all components
         that match all tags. Returns an empty set if one of the tags is missing
-        or if no component matches all tags.
+        or if no component matches all tags. The array isn't changed.
+        """
+        return self.query(And(*[Tag(tag) for tag in tags]))
+
+    def get_sampler(self, expression, weighted):
+        """Gets the sampler for a tag expression, only building it the first
+         time the expression is sampled since the taglist last changed."""
+        key = (expression.get_key(), weighted)
+        sampler = self.samplers.get(key)
+        if sampler is not None:
+            self.samplers.move_to_end(key)
+            return sampler
+        component_ids = list(self.query(expression))
+        if weighted:
+            weights = [self.component_weights[self.component_indices[
+                component_id]] for component_id in component_ids]
+            component_ids = [component_id for component_id, weight
+                             in zip(component_ids, weights) if weight > 0]
+            weights = [weight for weight in weights if weight > 0]
+            sampler = ComponentSampler(component_ids, weights)
+        else:
+            sampler = ComponentSampler(component_ids)
+        self.samplers[key] = sampler
+        if len(self.samplers) > SAMPLER_CACHE_SIZE:
+            self.samplers.popitem(last=False)
+        return sampler
+
+    def sample(self, tags, weighted=False, rng=random):
+        """
+        Picks the ID of a random component matching a tag expression, or
+        all of a list of tags. Weighted picks favour components in
+        proportion to their weights, and never pick zero weight components.
+        Raises an IndexError if there is nothing to pick.
         """
-        for tag in tags:
-            if tag not in self.tag_components.keys():
-                return(set())
-
-        good_components = self.tag_components[tags.pop(0)]
-        for tag in tags:
-            components = self.tag_components[tag]
-            good_components = good_components.intersection(components)
-        return(good_components)
+        if not isinstance(tags, Tag):
+            tags = And(*[Tag(tag) for tag in tags])
+        sampler = self.get_sampler(tags, weighted)
+        if not sampler.component_ids:
+            raise IndexError('No components match those tags')
+        return sampler.sample(rng)
@@ -5,8 +5,10 @@ Test files against the DDL.
 """
 
 import json
+import os
 
-from jsonschema import validate
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 
 class Validator:
@@ -16,10 +18,41 @@ class Validator:
     Methods for ensuring files meet DDL requirements.
     """
 
+    # Compiled validators, keyed by schema name. Each is stored alongside the
+    # modification time of the schema file it was built from.
+    validators = {}
+
+    @staticmethod
+    def get_schema_path(schema):
+        """Get the path of the file a schema is loaded from"""
+        return 'schemas/' + schema + '.json'
+
+    @staticmethod
+    def get_validator(schema):
+        """
+        Get the compiled validator for a schema, only loading and compiling
+        it if it hasn't been seen before or the schema file has changed.
+        """
+        schema_path = Validator.get_schema_path(schema)
+        mtime = os.path.getmtime(schema_path)
+        cached = Validator.validators.get(schema)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(schema_path) as schema_file:
+            schema_json = json.load(schema_file)
+
+        validator_class = validator_for(schema_json)
+        validator_class.check_schema(schema_json)
+        validator = validator_class(schema_json)
+        Validator.validators[schema] = (mtime, validator)
+        return validator
+
     @staticmethod
     def validate_file(file, schema):
         """
         Load a file and then validate it against the given schema.
+        Returns the loaded JSON so it doesn't need parsing again.
         """
 
         with open(file) as json_file:
@@ -28,14 +61,16 @@ class Validator:
 
             Validator.validate_json(json_object, schema)
 
+        return json_object
+
     @staticmethod
     def validate_json(json_object, schema):
         """
         Validate the given JSON object against a schema.
         """
 
-        with open('schemas/' + schema + '.json') as schema_file:
-
-            schema_json = json.load(schema_file)
-
-            validate(json_object, schema_json)
+        validator = Validator.get_validator(schema)
+        # Raise the same error jsonschema.validate would have picked.
+        error = best_match(validator.iter_errors(json_object))
+        if error is not None:
+            raise error
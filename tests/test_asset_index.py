@@ -0,0 +1,55 @@
+"""Tests the namespaced asset index"""
+from pytest import raises
+from ddl.asset_index import AssetIndex, split_full_id
+
+
+def test_split_full_id():
+    """Tests full IDs split at the last dot"""
+    assert split_full_id('pack.asset') == ('pack', 'asset')
+    assert split_full_id('pack.name.asset') == ('pack.name', 'asset')
+
+
+def test_mapping():
+    """Tests the index behaves like a dict of full IDs"""
+    index = AssetIndex({'a.one': 1, 'a.two': 2, 'b.one': 3})
+    assert len(index) == 3
+    assert index['b.one'] == 3
+    assert 'a.two' in index
+    assert 'c.two' not in index
+    assert set(index.keys()) == {'a.one', 'a.two', 'b.one'}
+    assert sorted(index.values()) == [1, 2, 3]
+    assert index.setdefault('a.one', 5) == 1
+    del index['a.one']
+    del index['b.one']
+    assert dict(index.items()) == {'a.two': 2}
+    assert list(index.namespaces) == ['a']
+    with raises(KeyError):
+        del index['b.one']
+    with raises(KeyError):
+        assert index['b.one']
+
+
+def test_merge_shares_namespaces():
+    """Tests merging shares assetpacks' dicts until either side changes"""
+    index = AssetIndex({'a.one': 1})
+    other = AssetIndex({'b.one': 2, 'b.two': 3})
+    index.merge(other)
+    assert len(index) == 3
+    assert index.namespaces['b'] is other.namespaces['b']
+    index['b.three'] = 4
+    assert 'b.three' not in other
+    other['b.four'] = 5
+    assert 'b.four' not in index
+    assert len(index) == 4
+    assert len(other) == 3
+
+
+def test_conflicts():
+    """Tests the same full ID in both indexes is a conflict, unless it's the
+    same asset"""
+    asset = object()
+    index = AssetIndex({'a.one': 1, 'b.one': asset})
+    other = AssetIndex({'a.one': 2, 'a.two': 3, 'b.one': asset})
+    assert index.get_conflicts(other) == ['a.one']
+    index.merge(AssetIndex({'a.two': 3}))
+    assert len(index) == 3
@@ -2,10 +2,16 @@
 Tests Assetpacks
 """
 
+import json
 import os
+import shutil
 from pytest import raises
 from ddl.assetpack import AssetpackFactory, Assetpack
 from ddl.asset import ComponentAsset
+from ddl.renderer import Renderer
+from ddl.taglist import TagList
+from ddl.dependency_graph import ComponentCycleException,\
+    MissingPartException
 
 
 class FakeProjection:
@@ -156,3 +162,308 @@ def test_add_image_errors(monkeypatch):
     with raises(ValueError):
         assert assetpack.add_image(image).message == "The key test.testimage\
          Please ensure no images share IDs"
+
+
+def test_factory_lazy_images():
+    """Tests a lazily loaded assetpack renders the same images"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    lazy_assetpack = AssetpackFactory.load('assetpacks/example_isometric',
+                                           lazy_images=True)
+    for key, image in assetpack.images.items():
+        lazy_image = lazy_assetpack.images[key]
+        assert lazy_image.lazy
+        assert lazy_image.get_image_sizes() == image.get_image_sizes()
+        assert lazy_image.image.tobytes() == image.image.tobytes()
+
+
+def test_factory_image_workers():
+    """Tests decoding on one or many threads gives the same images"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric',
+                                      image_workers=1)
+    threaded = AssetpackFactory.load('assetpacks/example_isometric',
+                                     image_workers=4)
+    assert list(assetpack.images.keys()) == list(threaded.images.keys())
+    for key, image in assetpack.images.items():
+        assert threaded.images[key].image.tobytes() == image.image.tobytes()
+
+
+def test_factory_missing_image(tmpdir):
+    """Tests a missing image file still raises the same error"""
+    pack_path = str(tmpdir.join('pack'))
+    shutil.copytree('assetpacks/example_isometric', pack_path)
+    os.remove(pack_path + '/art/1_wall_fuzzy.png')
+    with raises(FileNotFoundError):
+        AssetpackFactory.load(pack_path, image_workers=4)
+
+
+def test_factory_duplicate_image(tmpdir):
+    """Tests duplicate image IDs still raise the same error"""
+    pack_path = str(tmpdir.join('pack'))
+    shutil.copytree('assetpacks/example_isometric', pack_path)
+    with open(pack_path + '/images.json') as images_file:
+        images_json = json.load(images_file)
+    images_json['images'].append(images_json['images'][0])
+    with open(pack_path + '/images.json', 'w') as images_file:
+        json.dump(images_json, images_file)
+    with raises(ValueError):
+        AssetpackFactory.load(pack_path, image_workers=4)
+
+
+def render_every_image(assetpack):
+    """Renders every image in an assetpack, with every flip, side by side"""
+    image_location_list = []
+    for index, image in enumerate(assetpack.images.values()):
+        for flip_index, (h_flip, v_flip) in enumerate(
+                [(False, False), (True, False), (False, True), (True, True)]):
+            image_location_list.append((image, index*3, flip_index*3,
+                                        h_flip, v_flip))
+    renderer = Renderer(image_pixel_list=assetpack.projection
+                        .get_image_pixel_list(0, 0, image_location_list))
+    image = renderer.output('variable')
+    return image.crop(image.getbbox())
+
+
+def test_factory_trim_images():
+    """Tests trimmed images are smaller but render exactly the same"""
+    for path in ['assetpacks/example_isometric', 'assetpacks/example_top_down']:
+        assetpack = AssetpackFactory.load(path)
+        trimmed = AssetpackFactory.load(path, trim_images=True)
+        lazy_trimmed = AssetpackFactory.load(path, trim_images=True,
+                                             lazy_images=True)
+        for key, image in assetpack.images.items():
+            width, height = image.get_image_sizes()
+            trimmed_width, trimmed_height = \
+                trimmed.images[key].get_image_sizes()
+            assert trimmed_width <= width and trimmed_height <= height
+            assert lazy_trimmed.images[key].image.tobytes() ==\
+                trimmed.images[key].image.tobytes()
+        expected = render_every_image(assetpack).tobytes()
+        assert render_every_image(trimmed).tobytes() == expected
+        assert render_every_image(lazy_trimmed).tobytes() == expected
+
+
+def test_assetpack_view():
+    """Tests a view projects like resizing, but leaves the assetpack alone"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    view = assetpack.get_view(FakeProjection(29, 17))
+    assert assetpack.get_view(FakeProjection(29, 17)) is view
+    assert (view.projection.width, view.projection.height) == (29, 17)
+    assert (assetpack.projection.width, assetpack.projection.height) ==\
+        (294, 170)
+
+    resized = AssetpackFactory.load('assetpacks/example_isometric')
+    resized.resize_images(FakeProjection(29, 17))
+    component_id = 'easy-dungeon-ddl-example-iso.floor-2x2-exact'
+    image_location_list = assetpack.components[component_id]\
+        .get_image_location_list(1, 2)
+    view_pixel_list = view.get_image_pixel_list(3, 4, image_location_list,
+                                                with_depth=True)
+    resized_pixel_list = resized.projection.get_image_pixel_list(
+        3, 4, resized.components[component_id].get_image_location_list(1, 2),
+        with_depth=True)
+    for view_info, resized_info in zip(view_pixel_list, resized_pixel_list):
+        assert view_info[0].get_image_sizes() ==\
+            resized_info[0].get_image_sizes()
+        assert view_info[0].image.size == resized_info[0].image.size
+        assert view_info[1:] == resized_info[1:]
+    for image_id, image in view.images.items():
+        assert image.get_image_sizes() ==\
+            resized.images[image_id].get_image_sizes()
+        assert image.top_left == resized.images[image_id].top_left
+        assert assetpack.images[image_id].top_left !=\
+            resized.images[image_id].top_left
+    assert view.images is view.images
+    assert len(view.images) == len(assetpack.images)
+    assert sorted(view.images) == sorted(assetpack.images)
+    assetpack.images['easy-dungeon-ddl-example-iso.extra'] = \
+        assetpack.images['easy-dungeon-ddl-example-iso.floor-1x1-exact']
+    assert 'easy-dungeon-ddl-example-iso.extra' in view.images
+
+
+def assert_taglist_matches(assetpack):
+    """Checks an assetpack's taglist is the same as one built from scratch"""
+    taglist = TagList()
+    for component in assetpack.components.values():
+        taglist.add_component(component)
+    assert {tag: set(components) for tag, components
+            in assetpack.taglist.tag_components.items()} ==\
+        {tag: set(components) for tag, components
+         in taglist.tag_components.items()}
+
+
+def test_taglist_kept_up_to_date():
+    """Tests adding, removing, renaming and merging keep the taglist right"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    assert_taglist_matches(assetpack)
+    assetpack.change_assetpack_id('new_name')
+    assert_taglist_matches(assetpack)
+    assetpack.remove_component('new_name.floor-1x1-exact')
+    assert_taglist_matches(assetpack)
+    assetpack.rename_component('new_name.floor-2x2-exact', 'big-floor')
+    assert_taglist_matches(assetpack)
+    assetpack2 = AssetpackFactory.load('assetpacks/example_isometric')
+    assetpack.append_assetpack(assetpack2)
+    assert_taglist_matches(assetpack)
+    assetpack.add_component(ComponentAsset({"name": "Test",
+                                            "id": "test",
+                                            "parts": [],
+                                            "tags": ["new-tag"]},
+                                           assetpack))
+    assert_taglist_matches(assetpack)
+    with raises(ValueError):
+        assetpack.rename_component('new_name.big-floor', 'floor-wall-exact')
+
+
+def test_rename_component_parts():
+    """Tests components using a renamed component still find it"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    pack_id = assetpack.pack_id
+    component = assetpack.components[pack_id + '.floor-wall-exact']
+    parent = assetpack.components[pack_id + '.nested-component-test']
+    layout = parent.get_image_location_list(0, 0)
+    assetpack.rename_component(pack_id + '.floor-wall-exact', 'floor-wall')
+    assert assetpack.components[pack_id + '.floor-wall'] is component
+    assert component.get_full_id() == pack_id + '.floor-wall'
+    assert parent.parts[0]['component_id'] == 'floor-wall'
+    assert parent.parts[0]['asset_id'] == pack_id + '.floor-wall'
+    parent.reset_sub_parts()
+    parent.instantiate_sub_parts()
+    assert parent.get_image_location_list(0, 0) == layout
+
+
+def test_rename_appended_component():
+    """Tests renaming a component from an appended assetpack keeps it in
+     that assetpack"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    prop_assetpack = AssetpackFactory.load('assetpacks/example_props')
+    prop_assetpack.rescale_components(assetpack.projection)
+    assetpack.append_assetpack(prop_assetpack)
+    old_id = 'easy-dungeon-ddl-example-props.many-boxes'
+    new_id = 'easy-dungeon-ddl-example-props.renamed-thing'
+    component = assetpack.components[old_id]
+    assetpack.rename_component(old_id, 'renamed-thing')
+    assert assetpack.components[new_id] is component
+    assert assetpack.components[new_id].get_full_id() == new_id
+    assert old_id not in assetpack.components
+    assert new_id in assetpack.taglist.get_components_that_match_tags(
+        ['example'])
+    assert old_id not in assetpack.taglist.get_components_that_match_tags(
+        ['example'])
+    assert_taglist_matches(assetpack)
+
+
+def test_append_conflict_changes_nothing():
+    """Tests an append that fails leaves the assetpack as it was"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    assetpack2 = AssetpackFactory.load('assetpacks/example_isometric')
+    with raises(ValueError):
+        assetpack.append_assetpack(assetpack2)
+    assert len(assetpack.images) == 4
+    assert len(assetpack.components) == 5
+
+
+def write_components(pack_path, components):
+    """Changes the components of a copied assetpack"""
+    with open(pack_path + '/components.json', 'w') as components_file:
+        json.dump({"components": components}, components_file)
+
+
+def test_factory_component_cycle(tmpdir):
+    """Tests components that contain themselves fail to load"""
+    pack_path = str(tmpdir.join('pack'))
+    shutil.copytree('assetpacks/example_isometric', pack_path)
+    write_components(pack_path, [
+        {"name": "A", "id": "a", "tags": [],
+         "parts": [{"type": "component", "component_id": "b",
+                    "x": 0, "y": 0}]},
+        {"name": "B", "id": "b", "tags": [],
+         "parts": [{"type": "component", "component_id": "a",
+                    "x": 0, "y": 0}]}])
+    with raises(ComponentCycleException):
+        AssetpackFactory.load(pack_path, use_cache=False)
+
+
+def test_factory_missing_part(tmpdir):
+    """Tests components with parts that don't exist fail to load"""
+    pack_path = str(tmpdir.join('pack'))
+    shutil.copytree('assetpacks/example_isometric', pack_path)
+    write_components(pack_path, [
+        {"name": "A", "id": "a", "tags": [],
+         "parts": [{"type": "image", "image_id": "not-an-image",
+                    "x": 0, "y": 0}]}])
+    with raises(MissingPartException):
+        AssetpackFactory.load(pack_path, use_cache=False)
+
+
+def test_factory_precomputes_layouts():
+    """Tests every component's layout is ready once loaded"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    for component in assetpack.components.values():
+        assert component.image_layout is not None
+
+
+def test_changed_part_invalidates_dependants():
+    """Tests changing a component throws away layouts built from it"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    pack_id = assetpack.pack_id
+    child = assetpack.components[pack_id + '.floor-wall-exact']
+    parent = assetpack.components[pack_id + '.nested-component-test']
+    length = len(parent.get_image_location_list(0, 0))
+    child.add_image(assetpack.images[pack_id + '.exact-wall-1'], 1, 1)
+    assert parent.image_layout is None
+    assert len(parent.get_image_location_list(0, 0)) == length + 1
+    child.remove_last_part()
+    assert len(parent.get_image_location_list(0, 0)) == length
+    parent.get_image_layout()
+    assetpack.invalidate_image(assetpack.images[pack_id + '.exact-wall-1'])
+    assert parent.image_layout is None
+
+
+def test_appended_part_invalidates_dependants():
+    """Tests changing a component from an appended assetpack throws away
+     layouts built from it in the assetpack it was appended to"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    prop_assetpack = AssetpackFactory.load('assetpacks/example_props')
+    prop_assetpack.rescale_components(assetpack.projection)
+    assetpack.append_assetpack(prop_assetpack)
+    child = assetpack.components['easy-dungeon-ddl-example-props.many-boxes']
+    parent = ComponentAsset({"name": "Boxes on floor",
+                             "id": "boxes-on-floor",
+                             "parts": [],
+                             "tags": []},
+                            assetpack)
+    assetpack.add_component(parent)
+    parent.add_component(child, 0, 0)
+    length = len(parent.get_image_location_list(0, 0))
+    child.remove_last_part()
+    assert parent.image_layout is None
+    assert len(parent.get_image_location_list(0, 0)) == length - 1
+
+
+def render_component(assetpack, component_id):
+    """Renders one component of an assetpack on its own"""
+    component = assetpack.components[component_id]
+    renderer = Renderer(assetpack.projection.get_image_pixel_list(
+        0, 0, component.get_image_location_list(0, 0)))
+    return renderer.output('variable').tobytes()
+
+
+def test_rescaled_part_invalidates_dependants():
+    """Tests rescaling a component throws away layouts built from it, so
+     they render the same as layouts that were never cached"""
+    rendered = []
+    for cached in [True, False]:
+        assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+        pack_id = assetpack.pack_id
+        child = assetpack.components[pack_id + '.floor-wall-exact']
+        child.add_image(assetpack.images[pack_id + '.exact-wall-1'], 4, 2)
+        parent_id = pack_id + '.nested-component-test'
+        before = render_component(assetpack, parent_id)
+        if not cached:
+            for component in assetpack.components.values():
+                component.invalidate_image_layout()
+        child.rescale(2, 2)
+        assert assetpack.components[parent_id].image_layout is None
+        rendered.append(render_component(assetpack, parent_id))
+        assert rendered[-1] != before
+    assert rendered[0] == rendered[1]
@@ -0,0 +1,69 @@
+"""Tests batch rendering components"""
+
+import io
+import os
+import shutil
+from pytest import raises
+from PIL import Image
+from ddl.assetpack import AssetpackFactory
+import ddl.batch_render
+
+
+def test_read_manifest():
+    """Tests blank lines and comments are skipped in manifests"""
+    manifest = io.StringIO("# Floors\nfloor-*\n\n  floor-wall-exact  \n")
+    assert ddl.batch_render.read_manifest(manifest) == ['floor-*',
+                                                        'floor-wall-exact']
+
+
+def test_read_component_ids():
+    """Tests component IDs are read without loading the assetpack"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    pack_id, component_ids = ddl.batch_render.read_component_ids(
+        'assetpacks/example_isometric')
+    assert pack_id == assetpack.pack_id
+    assert sorted(component_ids) == sorted(assetpack.components.keys())
+
+
+def test_match_component_ids():
+    """Tests patterns are expanded in order, without duplicates"""
+    pack_id, component_ids = ddl.batch_render.read_component_ids(
+        'assetpacks/example_isometric')
+    full_ids = ddl.batch_render.match_component_ids(
+        pack_id, component_ids, ['floor-wall-exact', 'floor-*',
+                                 'easy-dungeon-ddl-example-iso.nested-*'])
+    assert full_ids == ['easy-dungeon-ddl-example-iso.floor-wall-exact',
+                        'easy-dungeon-ddl-example-iso.floor-1x1-exact',
+                        'easy-dungeon-ddl-example-iso.floor-2x2-exact',
+                        'easy-dungeon-ddl-example-iso.nested-component-test']
+    with raises(ValueError):
+        ddl.batch_render.match_component_ids(pack_id, component_ids,
+                                             ['nope'])
+
+
+def test_render_batch(tmpdir):
+    """Tests every component is rendered to a PNG, in and out of a pool"""
+    component_ids = ['easy-dungeon-ddl-example-iso.floor-2x2-exact',
+                     'easy-dungeon-ddl-example-iso.floor-wall-exact']
+    for processes in [1, 2]:
+        output_directory = str(tmpdir.join(str(processes)))
+        results = list(ddl.batch_render.render_batch(
+            'assetpacks/example_isometric', component_ids,
+            output_directory, processes))
+        assert sorted(result[0] for result in results) == component_ids
+        for component_id in component_ids:
+            image = Image.open(output_directory + '/' + component_id + '.png')
+            assert image.mode == 'RGBA'
+
+
+def test_render_batch_shared_pixels(tmpdir):
+    """Tests workers can render from a shared, compiled assetpack"""
+    pack_path = str(tmpdir.join('pack'))
+    shutil.copytree('assetpacks/example_isometric', pack_path)
+    component_ids = ['easy-dungeon-ddl-example-iso.floor-2x2-exact']
+    output_directory = str(tmpdir.join('output'))
+    results = list(ddl.batch_render.render_batch(
+        pack_path, component_ids, output_directory, 2, shared_pixels=True))
+    assert [result[0] for result in results] == component_ids
+    assert os.path.isfile(pack_path + '/pack.ddlcache')
+    assert os.path.isfile(output_directory + '/' + component_ids[0] + '.png')
@@ -7,6 +7,7 @@ import os
 from pytest import raises
 import PyInquirer
 from ddl.asset import ComponentAsset
+from ddl.assetpack import AssetpackFactory
 from click.testing import CliRunner
 import ddl.asset_exploration
 from test_asset_exploration import get_test_assetpack
@@ -341,3 +342,45 @@ def test_create_new_images_topdown(monkeypatch):
         }
     ]
 }"""
+
+
+def test_render_batch(tmpdir):
+    """Tests rendering a batch of components writes a PNG for each"""
+    runner = CliRunner()
+    result = runner.invoke(main, ["render-batch", "assetpacks/example_isometric",
+                                  "floor-2x2-*", "floor-wall-exact",
+                                  "--output", str(tmpdir),
+                                  "--processes", "2"])
+    assert result.exit_code == 0
+    assert tmpdir.join('easy-dungeon-ddl-example-iso.floor-2x2-exact.png').check()
+    assert tmpdir.join('easy-dungeon-ddl-example-iso.floor-wall-exact.png').check()
+    assert result.output.splitlines()[-1].startswith('Rendered 2 components')
+
+
+def test_render_batch_loads_once(tmpdir, monkeypatch):
+    """Tests rendering a batch in one process only loads the assetpack once"""
+    loads = []
+    load = AssetpackFactory.load
+
+    def counting_load(*args, **kwargs):
+        """Counts the times an assetpack is loaded"""
+        loads.append(args)
+        return load(*args, **kwargs)
+
+    monkeypatch.setattr(AssetpackFactory, 'load', counting_load)
+    runner = CliRunner()
+    result = runner.invoke(main, ["render-batch", "assetpacks/example_isometric",
+                                  "floor-*", "--output", str(tmpdir),
+                                  "--processes", "1"])
+    assert result.exit_code == 0
+    assert len(loads) == 1
+    assert tmpdir.join('easy-dungeon-ddl-example-iso.floor-2x2-exact.png').check()
+
+
+def test_render_batch_no_match(tmpdir):
+    """Tests rendering a pattern with no matches fails nicely"""
+    runner = CliRunner()
+    result = runner.invoke(main, ["render-batch", "assetpacks/example_isometric",
+                                  "does-not-exist", "--output", str(tmpdir)])
+    assert result.exit_code != 0
+    assert "No components match" in result.output
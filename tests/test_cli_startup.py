@@ -0,0 +1,43 @@
+"""
+Tests the non-interactive CLI commands start without importing the GUI and
+prompt libraries the interactive commands need.
+"""
+
+import subprocess
+import sys
+
+# Modules only the interactive commands should ever import.
+INTERACTIVE_MODULES = ['tkinter', 'PyInquirer', 'prompt_toolkit', 'PIL.ImageTk']
+
+
+def run_python(code):
+    """Runs some python in a fresh interpreter, returning what it printed"""
+    result = subprocess.run([sys.executable, '-c', code],
+                            stdout=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True)
+    return result.stdout
+
+
+def test_import_is_light():
+    """Tests importing the CLI imports none of the interactive modules"""
+    output = run_python(f"""
+import sys
+import ddl.cli
+print([name for name in {INTERACTIVE_MODULES} if name in sys.modules])
+""")
+    assert output.strip() == '[]'
+
+
+def test_validate_is_light():
+    """Tests validating an assetpack imports none of the interactive
+    modules"""
+    output = run_python(f"""
+import sys
+from ddl.cli import main
+main(['validate-assetpack', 'assetpacks/example_isometric'],
+     standalone_mode=False)
+print([name for name in {INTERACTIVE_MODULES} if name in sys.modules])
+""")
+    assert output.strip().splitlines()[-1] == '[]'
+
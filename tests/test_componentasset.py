@@ -239,3 +239,66 @@ def test_flipped_part_list():
     component.add_image(assetpack.images["easy-dungeon-ddl-example-td.floor-1x1-exact"], 0, 0, True, True)
     parts = component.get_image_location_list(2, 3)
     assert parts[0][3:5] == (True, True)
+
+
+def test_image_layout_cached():
+    """Tests the flattened layout is reused and translated by the offset"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    component = assetpack.components['easy-dungeon-ddl-example-iso.nested-component-test']
+    layout = component.get_image_layout()
+    assert component.get_image_layout() is layout
+    ill = component.get_image_location_list(2, 3)
+    assert [info[1:3] for info in ill] == [(info[1]+2, info[2]+3) for info in layout]
+
+
+def test_image_layout_invalidated():
+    """Tests changing a component's parts rebuilds its layout"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    data = {
+        "name": '',
+        "id": 'floor-1x2-exact',
+        "parts": [],
+        "tags": []
+    }
+    component = ComponentAsset(data, assetpack)
+    image = assetpack.images["easy-dungeon-ddl-example-iso.floor-1x1-exact"]
+    component.add_image(image, 0, 0)
+    assert len(component.get_image_location_list(0, 0)) == 1
+    component.add_component(assetpack.components["easy-dungeon-ddl-example-iso.floor-2x2-exact"], 2, 2)
+    component.instantiate_sub_parts()
+    assert len(component.get_image_location_list(0, 0)) == 5
+    component.rescale(2, 2)
+    assert component.get_image_location_list(0, 0)[-1][1:3] == (2, 2)
+    component.remove_last_part()
+    assert len(component.get_image_location_list(0, 0)) == 1
+
+
+def test_weight():
+    """Tests components have a weight, which is only saved if it's set"""
+    assetpack = FakeAssetpack()
+    data = {"name": "Test", "id": "test", "parts": [], "tags": []}
+    assert ComponentAsset(dict(data), assetpack).weight == 1
+    assert "weight" not in ComponentAsset(dict(data), assetpack).get_data()
+    data["weight"] = 2.5
+    component = ComponentAsset(data, assetpack)
+    assert component.weight == 2.5
+    assert component.get_data()["weight"] == 2.5
+
+
+def test_get_json_after_add_to_rendered_component():
+    """Tests a component that has been laid out still prints after parts
+    are added to it"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    pack_id = assetpack.pack_id
+    component = assetpack.components[pack_id + '.floor-wall-exact']
+    layout = component.get_image_location_list(0, 0)
+    component.add_image(assetpack.images[pack_id + '.exact-wall-1'], 1, 1)
+    component.add_component(assetpack.components[pack_id + '.floor-1x1-exact'],
+                            2, 2)
+    data = json.loads(component.get_json())
+    assert data['parts'][-2] == {"type": "image", "image_id": "exact-wall-1",
+                                 "x": 1, "y": 1}
+    assert data['parts'][-1] == {"type": "component",
+                                 "component_id": "floor-1x1-exact",
+                                 "x": 2, "y": 2}
+    assert len(component.get_image_location_list(0, 0)) == len(layout) + 2
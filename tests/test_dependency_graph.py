@@ -0,0 +1,77 @@
+"""Tests the component dependency graph"""
+from pytest import raises
+from ddl.dependency_graph import DependencyGraph, MissingPartException,\
+    ComponentCycleException
+
+
+class FakeComponent:
+    """A fake component with some parts"""
+    def __init__(self, full_id, component_ids, image_ids=()):
+        self.full_id = full_id
+        self.parts = [{'type': 'component', 'asset_id': component_id}
+                      for component_id in component_ids] +\
+            [{'type': 'image', 'asset_id': image_id}
+             for image_id in image_ids]
+
+    def get_full_id(self):
+        """Returns the ID it was made with"""
+        return self.full_id
+
+
+def make_graph(*components, images=('test.image',)):
+    """Makes a graph from some fake components"""
+    return DependencyGraph({component.get_full_id(): component
+                            for component in components},
+                           {image_id: None for image_id in images})
+
+
+def test_topological_order():
+    """Tests components come after everything they use"""
+    graph = make_graph(FakeComponent('test.top', ['test.middle', 'test.a']),
+                       FakeComponent('test.middle', ['test.a', 'test.b']),
+                       FakeComponent('test.a', [], ['test.image']),
+                       FakeComponent('test.b', ['test.a']))
+    order = graph.get_topological_order()
+    assert sorted(order) == ['test.a', 'test.b', 'test.middle', 'test.top']
+    for component_id, part_ids in graph.component_parts.items():
+        for part_id in part_ids:
+            assert order.index(part_id) < order.index(component_id)
+
+
+def test_cycle():
+    """Tests a component that contains itself is caught"""
+    graph = make_graph(FakeComponent('test.a', ['test.b']),
+                       FakeComponent('test.b', ['test.c']),
+                       FakeComponent('test.c', ['test.a']),
+                       FakeComponent('test.d', ['test.c']))
+    with raises(ComponentCycleException) as error:
+        graph.get_topological_order()
+    assert 'test.a -> test.b -> test.c -> test.a' in str(error.value)
+    with raises(ComponentCycleException):
+        make_graph(FakeComponent('test.a', ['test.a']))\
+            .get_topological_order()
+
+
+def test_missing_parts():
+    """Tests missing parts are only an error in the assetpack being checked"""
+    graph = make_graph(FakeComponent('test.a', ['other.b'], ['test.image']),
+                       FakeComponent('test.b', [], ['test.missing']))
+    assert graph.get_missing_parts() == [('test.a', 'other.b'),
+                                         ('test.b', 'test.missing')]
+    with raises(MissingPartException):
+        graph.check_parts('test')
+    make_graph(FakeComponent('test.a', ['other.b'])).check_parts('test')
+
+
+def test_dependants():
+    """Tests everything built from a part is found, however indirectly"""
+    graph = make_graph(FakeComponent('test.top', ['test.middle']),
+                       FakeComponent('test.middle', ['test.a']),
+                       FakeComponent('test.a', [], ['test.image']),
+                       FakeComponent('test.b', []))
+    assert graph.get_dependants('test.a') == {'test.middle', 'test.top'}
+    assert graph.get_dependants(image_id='test.image') ==\
+        {'test.a', 'test.middle', 'test.top'}
+    graph.update_component(FakeComponent('test.middle', ['test.b']))
+    assert graph.get_dependants('test.a') == set()
+    assert graph.get_dependants('test.b') == {'test.middle', 'test.top'}
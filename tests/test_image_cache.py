@@ -0,0 +1,83 @@
+"""Tests the memory-bounded image cache"""
+
+from PIL import Image
+from ddl.image_cache import ImageCache
+
+
+def make_loader(width, height, calls):
+    """Makes a loader that records how many times it's been called"""
+    def loader():
+        """Creates a new RGBA image"""
+        calls.append((width, height))
+        return Image.new('RGBA', (width, height))
+    return loader
+
+
+def test_get_caches():
+    """Tests an image is only loaded once"""
+    cache = ImageCache(1000)
+    calls = []
+    image = cache.get('a', make_loader(5, 5, calls))
+    assert cache.get('a', make_loader(5, 5, calls)) is image
+    assert len(calls) == 1
+    assert cache.used == 100
+
+
+def test_evicts_least_recently_used():
+    """Tests going over budget throws away the oldest unused image"""
+    cache = ImageCache(250)
+    calls = []
+    cache.get('a', make_loader(5, 5, calls))
+    cache.get('b', make_loader(5, 5, calls))
+    cache.get('a', make_loader(5, 5, calls))
+    cache.get('c', make_loader(5, 5, calls))
+    assert list(cache.entries.keys()) == ['a', 'c']
+    assert cache.used == 200
+
+
+def test_keeps_oversized_image():
+    """Tests an image bigger than the budget is still kept until replaced"""
+    cache = ImageCache(10)
+    calls = []
+    cache.get('a', make_loader(5, 5, calls))
+    assert list(cache.entries.keys()) == ['a']
+    cache.get('b', make_loader(5, 5, calls))
+    assert list(cache.entries.keys()) == ['b']
+
+
+def test_set_budget():
+    """Tests shrinking the budget evicts images"""
+    cache = ImageCache(1000)
+    calls = []
+    cache.get('a', make_loader(5, 5, calls))
+    cache.get('b', make_loader(5, 5, calls))
+    cache.set_budget(100)
+    assert list(cache.entries.keys()) == ['b']
+    cache.clear()
+    assert cache.used == 0
+    assert not cache.entries
+
+
+def test_discard():
+    """Tests discarding an image frees up its space"""
+    cache = ImageCache()
+    cache.get('a', lambda: Image.new('RGBA', (2, 2)))
+    cache.discard('a')
+    cache.discard('not there')
+    assert len(cache.entries) == 0
+    assert cache.used == 0
+
+
+def test_forget_owner():
+    """Tests an owner's images are thrown away once it has gone"""
+    cache = ImageCache()
+    cache.get('a', lambda: Image.new('RGBA', (2, 2)), owner=1)
+    cache.get('b', lambda: Image.new('RGBA', (2, 2)), owner=1)
+    cache.get('c', lambda: Image.new('RGBA', (2, 2)), owner=2)
+    cache.discard('b')
+    cache.forget_owner(1)
+    assert len(cache.entries) == 2
+    cache.get('c', lambda: Image.new('RGBA', (2, 2)), owner=2)
+    assert list(cache.entries.keys()) == ['c']
+    assert cache.used == 16
+    assert cache.owner_keys == {2: {'c'}}
@@ -2,7 +2,11 @@
 Tests the methods of ImageAsset
 """
 
+import gc
+import weakref
 from ddl.asset import ImageAsset
+from ddl.image_cache import IMAGE_CACHE
+from PIL import Image
 from PIL.PngImagePlugin import PngImageFile
 
 
@@ -66,3 +70,237 @@ def test_resize():
         raise AssertionError()
     if not image.top_left['y'] == 18:
         raise AssertionError()
+
+
+def test_lazy_image():
+    """Tests a lazy image knows its size before it has been decoded"""
+    data = {"name": "test_name",
+            "id": "test",
+            "top_left": {"x": 152, "y": 6},
+            "image": "1x1_floor_fuzzy.png"}
+    image = ImageAsset(data, "example_isometric", "assetpacks/example_isometric",
+                       lazy=True)
+    assert image.get_image_sizes() == (304, 201)
+    assert image.image.mode == 'RGBA'
+    assert image.image.size == (304, 201)
+
+
+def test_lazy_resize():
+    """Tests a lazy image decodes at its new size after resizing"""
+    data = {"name": "test_name",
+            "id": "test",
+            "top_left": {"x": 152, "y": 6},
+            "image": "1x1_floor_fuzzy.png"}
+    image = ImageAsset(data, "example_isometric", "assetpacks/example_isometric",
+                       lazy=True)
+    image.resize(2, 3)
+    assert image.get_image_sizes() == (608, 603)
+    assert image.image.size == (608, 603)
+    assert image.top_left == {"x": 304, "y": 18}
+
+
+def test_flipped_images():
+    """Tests every flip combination is right and only made once"""
+    data = {"name": "test_name",
+            "id": "test",
+            "image": "1x1_floor_fuzzy.png"}
+    image = ImageAsset(data, "example_isometric", "assetpacks/example_isometric")
+    original = image.get_image()
+    assert original is image.image
+    h_flipped = image.get_image(True, False)
+    assert h_flipped is image.get_image(True, False)
+    assert h_flipped.tobytes() == \
+        original.transpose(Image.FLIP_LEFT_RIGHT).tobytes()
+    v_flipped = image.get_image(False, True)
+    assert v_flipped.tobytes() == \
+        original.transpose(Image.FLIP_TOP_BOTTOM).tobytes()
+    both_flipped = image.get_image(True, True)
+    assert both_flipped.tobytes() == \
+        h_flipped.transpose(Image.FLIP_TOP_BOTTOM).tobytes()
+
+
+def test_cache_does_not_keep_image():
+    """Tests cached variants don't keep an image alive, and go with it"""
+    data = {"name": "test_name",
+            "id": "test",
+            "image": "1x1_floor_fuzzy.png"}
+    image = ImageAsset(data, "example_isometric", "assetpacks/example_isometric")
+    image.get_image(True, False)
+    cache_id = image.cache_id
+    assert cache_id in IMAGE_CACHE.owner_keys
+    image_ref = weakref.ref(image)
+    del image
+    gc.collect()
+    assert image_ref() is None
+    IMAGE_CACHE.get('unrelated', lambda: Image.new('RGBA', (1, 1)))
+    IMAGE_CACHE.discard('unrelated')
+    assert cache_id not in IMAGE_CACHE.owner_keys
+    assert not [key for key in IMAGE_CACHE.entries if key[0] == cache_id]
+
+
+def test_flipped_image_resized():
+    """Tests resizing an image throws away its old flipped variants"""
+    data = {"name": "test_name",
+            "id": "test",
+            "image": "1x1_floor_fuzzy.png"}
+    image = ImageAsset(data, "example_isometric", "assetpacks/example_isometric")
+    image.get_image(True, False)
+    image.resize(2, 2)
+    assert image.get_image(True, False).size == (608, 402)
+
+
+def test_alpha_masks():
+    """Tests visible and opaque masks come from the alpha channel"""
+    data = {"name": "test_name",
+            "id": "test",
+            "image": "1x1_floor_fuzzy.png"}
+    image = ImageAsset(data, "example_isometric", "assetpacks/example_isometric")
+    visible, opaque = image.get_alpha_masks()
+    alpha = image.image.getchannel('A')
+    for position in [(0, 0), (152, 100), (5, 100)]:
+        assert (visible.getpixel(position) == 255) == \
+            (alpha.getpixel(position) > 0)
+        assert (opaque.getpixel(position) == 255) == \
+            (alpha.getpixel(position) == 255)
+    assert image.get_alpha_masks() == (visible, opaque)
+    flipped_visible, _ = image.get_alpha_masks(True, False)
+    assert flipped_visible.tobytes() == \
+        visible.transpose(Image.FLIP_LEFT_RIGHT).tobytes()
+
+
+def make_image_asset(image):
+    """Makes an image asset around an image that's already been decoded"""
+    data = {"name": "test_name",
+            "id": "test",
+            "image": "made_up.png"}
+    return ImageAsset(data, "test", "nowhere", image=image)
+
+
+def test_alpha_classes():
+    """Tests images are classified by their alpha channel"""
+    opaque = Image.new('RGBA', (4, 4), (1, 2, 3, 255))
+    assert make_image_asset(opaque).get_alpha_class() == 'opaque'
+    binary = opaque.copy()
+    binary.putpixel((0, 0), (0, 0, 0, 0))
+    assert make_image_asset(binary).get_alpha_class() == 'binary'
+    alpha = opaque.copy()
+    alpha.putpixel((0, 0), (0, 0, 0, 128))
+    assert make_image_asset(alpha).get_alpha_class() == 'alpha'
+
+
+def test_paste_info():
+    """Tests paste info crops transparent margins and picks a mask"""
+    image = Image.new('RGBA', (10, 8), (0, 0, 0, 0))
+    image.paste((9, 9, 9, 255), (2, 3, 5, 7))
+    image_asset = make_image_asset(image)
+    cropped, offset_x, offset_y, mask = image_asset.get_paste_info()
+    assert (offset_x, offset_y) == (2, 3)
+    assert cropped.size == (3, 4)
+    assert mask.mode == '1'
+    _, offset_x, offset_y, _ = image_asset.get_paste_info(True, True)
+    assert (offset_x, offset_y) == (5, 1)
+    empty = make_image_asset(Image.new('RGBA', (3, 3), (0, 0, 0, 0)))
+    assert empty.get_paste_info() == (None, 0, 0, None)
+    opaque = make_image_asset(Image.new('RGBA', (3, 3), (0, 0, 0, 255)))
+    assert opaque.get_paste_info()[3] is None
+
+
+def test_paste_info_makes_no_masks():
+    """Tests working out paste info doesn't make the alpha masks, which are
+     only needed for culling"""
+    image = Image.new('RGBA', (10, 8), (0, 0, 0, 0))
+    image.paste((9, 9, 9, 128), (2, 3, 5, 7))
+    image_asset = make_image_asset(image)
+    image_asset.get_paste_info()
+    image_asset.get_paste_info(True, False)
+    assert not [key for key in IMAGE_CACHE.entries
+                if key[0] == image_asset.cache_id and
+                key[-1] in ['visible', 'opaque']]
+
+
+def test_opaque_box():
+    """Tests the opaque box is the biggest fully opaque rectangle, flipped
+     to match the image"""
+    image = Image.new('RGBA', (10, 8), (0, 0, 0, 0))
+    image.paste((9, 9, 9, 255), (2, 3, 5, 7))
+    image.paste((9, 9, 9, 255), (5, 4, 6, 5))
+    image.paste((9, 9, 9, 128), (6, 0, 10, 8))
+    image_asset = make_image_asset(image)
+    assert image_asset.get_opaque_box() == (2, 3, 5, 7)
+    assert image_asset.get_opaque_box(True, False) == (5, 3, 8, 7)
+    assert image_asset.get_opaque_box(False, True) == (2, 1, 5, 5)
+    assert image.crop(image_asset.get_opaque_box()).getchannel('A')\
+        .getextrema() == (255, 255)
+    opaque = make_image_asset(Image.new('RGBA', (3, 4), (0, 0, 0, 255)))
+    assert opaque.get_opaque_box() == (0, 0, 3, 4)
+    empty = make_image_asset(Image.new('RGBA', (3, 3), (0, 0, 0, 200)))
+    assert empty.get_opaque_box() is None
+
+
+def test_trim():
+    """Tests trimming crops transparent margins and moves top_left to match"""
+    image = Image.new('RGBA', (10, 8), (0, 0, 0, 0))
+    image.paste((9, 9, 9, 255), (2, 3, 5, 7))
+    data = {"name": "test_name",
+            "id": "test",
+            "image": "made_up.png",
+            "top_left": {"x": 6, "y": 4}}
+    image_asset = ImageAsset(data, "test", "nowhere", image=image, trim=True)
+    assert image_asset.get_image_sizes() == (3, 4)
+    assert image_asset.top_left == {"x": 4, "y": 1}
+    assert data["top_left"] == {"x": 6, "y": 4}
+
+
+def test_mipmaps():
+    """Tests mipmap levels halve in size and are picked to only shrink"""
+    image_asset = make_image_asset(Image.new('RGBA', (10, 7), (1, 2, 3, 255)))
+    assert image_asset.get_mipmap(0) is image_asset.image
+    assert image_asset.get_mipmap(1).size == (5, 4)
+    assert image_asset.get_mipmap(2).size == (3, 2)
+    assert image_asset.get_mipmap(4).size == (1, 1)
+    assert image_asset.get_mipmap_level((10, 7)) == 0
+    assert image_asset.get_mipmap_level((6, 4)) == 0
+    assert image_asset.get_mipmap_level((5, 4)) == 1
+    assert image_asset.get_mipmap_level((1, 1)) == 4
+
+
+def test_scaled():
+    """Tests scaled views leave the original alone"""
+    image = Image.new('RGBA', (40, 20), (0, 0, 0, 0))
+    image.paste((9, 9, 9, 255), (10, 0, 30, 20))
+    data = {"name": "test_name",
+            "id": "test",
+            "image": "made_up.png",
+            "top_left": {"x": 7, "y": 3}}
+    image_asset = ImageAsset(data, "test", "nowhere", image=image)
+    assert image_asset.scaled(1) is image_asset
+    scaled = image_asset.scaled(0.25, 0.5)
+    assert image_asset.scaled(0.25, 0.5) is scaled
+    assert scaled.get_image_sizes() == (10, 10)
+    assert scaled.image.size == (10, 10)
+    assert scaled.top_left == {"x": 2, "y": 2}
+    assert image_asset.get_image_sizes() == (40, 20)
+    assert image_asset.top_left == {"x": 7, "y": 3}
+
+
+def test_scaled_views_go_through_cache():
+    """Tests scaled views keep their pixels in the image cache as variants of
+     the source image, and aren't kept once they're no longer used"""
+    image = Image.new('RGBA', (40, 20), (9, 9, 9, 255))
+    image_asset = make_image_asset(image)
+    for scale in range(1, 20):
+        scaled = image_asset.scaled(scale/20)
+        scaled.get_paste_info()
+        assert [key for key in IMAGE_CACHE.entries
+                if key[0] == image_asset.cache_id and
+                key[2:4] == ('scaled', scale/20)]
+    scaled_ref = weakref.ref(scaled)
+    del scaled
+    gc.collect()
+    assert scaled_ref() is None
+    assert len(image_asset.scaled_images) == 0
+    cache_id = image_asset.cache_id
+    del image_asset
+    gc.collect()
+    IMAGE_CACHE.discard_dead_owners()
+    assert not [key for key in IMAGE_CACHE.entries if key[0] == cache_id]
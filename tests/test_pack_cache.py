@@ -0,0 +1,146 @@
+"""Tests compiling and loading assetpack cache files"""
+
+import json
+import os
+import shutil
+import struct
+from pytest import raises
+from ddl.assetpack import AssetpackFactory
+from ddl.pack_cache import compile_assetpack, is_cache_fresh, load_cache,\
+    get_cache_path, PackCacheException, MAGIC, align
+from ddl.validator import Validator
+
+
+def copy_assetpack(tmpdir, name='example_isometric'):
+    """Copies an example assetpack somewhere it can be compiled"""
+    pack_path = str(tmpdir.join(name))
+    shutil.copytree('assetpacks/' + name, pack_path)
+    return pack_path
+
+
+def test_compile_assetpack(tmpdir):
+    """Tests a compiled assetpack loads the same metadata and pixels"""
+    pack_path = copy_assetpack(tmpdir)
+    assert not is_cache_fresh(pack_path)
+    cache_path = compile_assetpack(pack_path)
+    assert cache_path == get_cache_path(pack_path)
+    assert is_cache_fresh(pack_path)
+
+    pack_json, images_json, components_json, images = load_cache(pack_path)
+    assert pack_json['id'] == 'easy-dungeon-ddl-example-iso'
+    assert len(images) == len(images_json['images'])
+    parts = components_json['components'][0]['parts']
+    assert parts[0]['asset_id'] == 'easy-dungeon-ddl-example-iso.floor-1x1-exact'
+
+    source = AssetpackFactory.load(pack_path, use_cache=False)
+    for image_data, image in zip(images_json['images'], images):
+        source_image = source.images[pack_json['id'] + '.' + image_data['id']]
+        assert image.mode == 'RGBA'
+        assert image.tobytes() == source_image.image.tobytes()
+
+
+def test_load_uses_fresh_cache(tmpdir):
+    """Tests the factory only uses the cache while it's newer than the
+    sources"""
+    pack_path = copy_assetpack(tmpdir, 'example_top_down')
+    compile_assetpack(pack_path)
+    assetpack = AssetpackFactory.load(pack_path)
+    image = assetpack.images['easy-dungeon-ddl-example-td.floor-1x1-exact']
+    # Without use_cache the sources are always validated and decoded.
+    assert not image.image.readonly
+    assetpack = AssetpackFactory.load(pack_path, use_cache=True)
+    image = assetpack.images['easy-dungeon-ddl-example-td.floor-1x1-exact']
+    assert image.image.readonly
+    assert image.image.mode == 'RGBA'
+    assert len(assetpack.components) == len(
+        AssetpackFactory.load(pack_path, use_cache=False).components)
+
+    later = os.path.getmtime(get_cache_path(pack_path)) + 10
+    os.utime(pack_path + '/images.json', (later, later))
+    assert not is_cache_fresh(pack_path)
+    assetpack = AssetpackFactory.load(pack_path, use_cache=True)
+    image = assetpack.images['easy-dungeon-ddl-example-td.floor-1x1-exact']
+    assert not image.image.readonly
+
+
+def test_cache_stale_after_nested_art_changes(tmpdir):
+    """Tests changing art in a subdirectory makes the cache stale"""
+    pack_path = copy_assetpack(tmpdir, 'example_top_down')
+    os.mkdir(pack_path + '/art/floors')
+    with open(pack_path + '/images.json') as images_file:
+        images_json = json.load(images_file)
+    image_data = images_json['images'][0]
+    os.rename(pack_path + '/art/' + image_data['image'],
+              pack_path + '/art/floors/' + image_data['image'])
+    image_data['image'] = 'floors/' + image_data['image']
+    with open(pack_path + '/images.json', 'w') as images_file:
+        json.dump(images_json, images_file)
+    compile_assetpack(pack_path)
+    assert is_cache_fresh(pack_path)
+    later = os.path.getmtime(get_cache_path(pack_path)) + 10
+    os.utime(pack_path + '/art/' + image_data['image'], (later, later))
+    assert not is_cache_fresh(pack_path)
+
+
+def test_cache_stale_after_schema_changes(tmpdir):
+    """Tests changing a schema makes the cache stale"""
+    pack_path = copy_assetpack(tmpdir, 'example_top_down')
+    compile_assetpack(pack_path)
+    assert is_cache_fresh(pack_path)
+    schema_path = Validator.get_schema_path('images')
+    schema_times = os.stat(schema_path)
+    later = os.path.getmtime(get_cache_path(pack_path)) + 10
+    try:
+        os.utime(schema_path, (later, later))
+        assert not is_cache_fresh(pack_path)
+    finally:
+        os.utime(schema_path, ns=(schema_times.st_atime_ns,
+                                  schema_times.st_mtime_ns))
+
+
+def test_compile_long_ids(tmpdir):
+    """Tests long IDs and paths don't push the header into the pixels"""
+    pack_path = copy_assetpack(tmpdir, 'example_top_down')
+    with open(pack_path + '/images.json') as images_file:
+        images_json = json.load(images_file)
+    images_json['images'] = [dict(image_data, id='image-' + 'x'*500 +
+                                  '-' + str(index))
+                             for index, image_data
+                             in enumerate(images_json['images']*20)]
+    with open(pack_path + '/images.json', 'w') as images_file:
+        json.dump(images_json, images_file)
+    with open(pack_path + '/components.json', 'w') as components_file:
+        json.dump({"components": []}, components_file)
+    compile_assetpack(pack_path)
+    with open(get_cache_path(pack_path), 'rb') as cache_file:
+        cache_file.seek(len(MAGIC))
+        header_size, = struct.unpack('<Q', cache_file.read(8))
+        header = json.loads(cache_file.read(header_size).decode('utf-8'))
+    # The pixels start at the first boundary after the header's real length.
+    header_length = len(json.dumps(header).encode('utf-8'))
+    assert header['pixels'][0]['offset'] == \
+        align(len(MAGIC) + 8 + header_length)
+    _, images_json, _, images = load_cache(pack_path)
+    assert len(images) == len(images_json['images'])
+    source = AssetpackFactory.load(pack_path)
+    for image_data, image in zip(images_json['images'], images):
+        source_image = source.images[source.pack_id + '.' + image_data['id']]
+        assert image.tobytes() == source_image.image.tobytes()
+
+
+def test_load_bad_cache(tmpdir):
+    """Tests a file that isn't a cache is rejected"""
+    pack_path = copy_assetpack(tmpdir)
+    with open(get_cache_path(pack_path), 'wb') as cache_file:
+        cache_file.write(b'not a cache at all')
+    with raises(PackCacheException):
+        load_cache(pack_path)
+
+
+def test_load_shared_pixels(tmpdir):
+    """Tests loading with shared pixels compiles the cache and maps it"""
+    pack_path = copy_assetpack(tmpdir, 'example_top_down')
+    assetpack = AssetpackFactory.load(pack_path, shared_pixels=True)
+    assert is_cache_fresh(pack_path)
+    for image in assetpack.images.values():
+        assert image.image.readonly
@@ -0,0 +1,34 @@
+"""Tests the streaming PNG writer"""
+import io
+from pytest import raises
+from PIL import Image
+from ddl.png_writer import PNGWriter
+
+
+def test_write_strips():
+    """Tests writing an image in strips gives back the same image"""
+    image = Image.new('RGBA', (13, 9), (0, 0, 0, 0))
+    image.paste((10, 200, 30, 255), (2, 2, 11, 6))
+    image.putpixel((0, 8), (1, 2, 3, 4))
+    png_file = io.BytesIO()
+    with PNGWriter(png_file, 13, 9, compress_level=0) as writer:
+        writer.write_rows(image.crop((0, 0, 13, 4)))
+        writer.write_rows(image.crop((0, 4, 13, 9)))
+    png_file.seek(0)
+    written = Image.open(png_file)
+    assert written.mode == 'RGBA'
+    assert written.tobytes() == image.tobytes()
+
+
+def test_wrong_rows():
+    """Tests rows that don't fit the PNG are refused"""
+    writer = PNGWriter(io.BytesIO(), 4, 2)
+    with raises(ValueError):
+        writer.write_rows(Image.new('RGBA', (5, 1)))
+    with raises(ValueError):
+        writer.write_rows(Image.new('RGB', (4, 1)))
+    with raises(ValueError):
+        writer.write_rows(Image.new('RGBA', (4, 3)))
+    writer.write_rows(Image.new('RGBA', (4, 1)))
+    with raises(ValueError):
+        writer.close()
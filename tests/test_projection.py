@@ -150,3 +150,66 @@ def test_topdown_get_pixels():
     assert projection.get_location_in_pixels(1, 0) == (16, 0)
     assert projection.get_location_in_pixels(1, 1) == (16, 10)
     assert projection.get_location_in_pixels(1, -1) == (16, -10)
+
+
+def test_isometric_get_pixel_arrays():
+    """Tests the isometric sequence transform matches the single one"""
+    projection = IsometricProjection(17, 11)
+    x_coordinates = [0, 1, 1, 1, 0.5, -3.25]
+    y_coordinates = [0, 0, 1, -1, 2.5, 7]
+    pixel_xs, pixel_ys = projection.get_locations_in_pixels(x_coordinates,
+                                                            y_coordinates)
+    expected = [projection.get_location_in_pixels(x_coordinate, y_coordinate)
+                for x_coordinate, y_coordinate
+                in zip(x_coordinates, y_coordinates)]
+    assert list(zip(pixel_xs, pixel_ys)) == expected
+
+
+def test_topdown_get_pixel_arrays():
+    """Tests the topdown sequence transform matches the single one"""
+    projection = TopDownProjection(15, 10)
+    x_coordinates = [0, 1, 1, 1, 0.5, -3.25]
+    y_coordinates = [0, 0, 1, -1, 2.45, 7]
+    pixel_xs, pixel_ys = projection.get_locations_in_pixels(x_coordinates,
+                                                            y_coordinates)
+    expected = [projection.get_location_in_pixels(x_coordinate, y_coordinate)
+                for x_coordinate, y_coordinate
+                in zip(x_coordinates, y_coordinates)]
+    assert list(zip(pixel_xs, pixel_ys)) == expected
+
+
+def test_get_image_pixel_arrays():
+    """Tests the sequence path applies grid and flipped image offsets"""
+    image = FakeImageAsset()
+    projection = TopDownProjection(10, 10)
+    pixel_xs, pixel_ys = projection.get_image_pixel_arrays(1, 3,
+                                                           [image, image],
+                                                           [0, 0],
+                                                           [0, 0],
+                                                           [True, False],
+                                                           [False, True])
+    assert list(pixel_xs) == [2, 8]
+    assert list(pixel_ys) == [27, 23]
+
+
+def test_empty_image_pixel_list():
+    """Tests an empty list of images gives an empty list of pixels"""
+    projection = IsometricProjection(10, 10)
+    assert projection.get_image_pixel_list(0, 0, []) == []
+
+
+def test_pixel_list_with_depth():
+    """Tests depths include the grid offset and suit each projection"""
+    image = FakeImageAsset()
+    image_location_list = [(image, 1, 2, False, False),
+                           (image, 3, 0, False, False)]
+    isometric = IsometricProjection(10, 10)
+    pixel_list = isometric.get_image_pixel_list(1, 1, image_location_list,
+                                                with_depth=True)
+    assert [info[5] for info in pixel_list] == [5, 5]
+    assert [info[:5] for info in pixel_list] == \
+        isometric.get_image_pixel_list(1, 1, image_location_list)
+    topdown = TopDownProjection(10, 10)
+    pixel_list = topdown.get_image_pixel_list(1, 1, image_location_list,
+                                              with_depth=True)
+    assert [info[5] for info in pixel_list] == [3, 1]
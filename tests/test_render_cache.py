@@ -0,0 +1,58 @@
+"""Tests the cache of rendered components"""
+from ddl.assetpack import AssetpackFactory
+from ddl.projection import TopDownProjection
+from ddl.render_cache import RenderCache, get_render_key
+
+
+def get_test_component():
+    """Gets a real component from a real assetpack"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    component = assetpack.components[
+        'easy-dungeon-ddl-example-iso.floor-2x2-exact']
+    return (assetpack, component)
+
+
+def test_render_is_cached():
+    """Tests rendering a component twice only renders it once"""
+    assetpack, component = get_test_component()
+    render_cache = RenderCache()
+    image = render_cache.render(component, assetpack.projection)
+    assert render_cache.render(component, assetpack.projection) is image
+    assert len(render_cache.entries) == 1
+
+
+def test_render_key():
+    """Tests the key changes with the projection and the component"""
+    assetpack, component = get_test_component()
+    key = get_render_key(component, assetpack.projection)
+    assert key[0] == 'easy-dungeon-ddl-example-iso.floor-2x2-exact'
+    assert key[1:4] == ('IsometricProjection', 294, 170)
+    assert get_render_key(component, assetpack.projection) == key
+    assert get_render_key(component, TopDownProjection(294, 170)) != key
+    component.add_image(assetpack.images[
+        'easy-dungeon-ddl-example-iso.exact-wall-1'], 0, 0)
+    assert get_render_key(component, assetpack.projection) != key
+
+
+def test_changed_component_renders_again():
+    """Tests a changed component isn't given its old render"""
+    assetpack, component = get_test_component()
+    render_cache = RenderCache()
+    image = render_cache.render(component, assetpack.projection)
+    component.remove_last_part()
+    changed_image = render_cache.render(component, assetpack.projection)
+    assert changed_image is not image
+    assert changed_image.tobytes() != image.tobytes()
+    render_cache.forget_component(component.get_full_id())
+    assert len(render_cache.entries) == 0
+    assert render_cache.used == 0
+
+
+def test_render_key_is_stable():
+    """Tests the key is made of the layout itself, so the same component
+    loaded twice gets the same key"""
+    assetpack, component = get_test_component()
+    other_assetpack, other_component = get_test_component()
+    key = get_render_key(component, assetpack.projection)
+    assert get_render_key(other_component, other_assetpack.projection) == key
+    assert key[4][0][0] == 'easy-dungeon-ddl-example-iso.floor-1x1-exact'
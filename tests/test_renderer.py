@@ -1,7 +1,11 @@
 """Tests the renderer, just the renderer and nothing but the renderer"""
+import io
+import zlib
 from pytest import raises
 from PIL import Image
 from ddl.renderer import Renderer
+from ddl.assetpack import AssetpackFactory
+from ddl.asset import ImageAsset
 
 
 def test_init_with_ipl(monkeypatch):
@@ -66,11 +70,17 @@ def test_add_to_image():
             self.v_flip = v_flip
             return self.image
 
+        def get_paste_info(self, h_flip, v_flip):
+            """Gets a fake image to paste with itself as the mask, cropped
+            by 1 pixel on the left and 2 on the top"""
+            image = self.get_image(h_flip, v_flip)
+            return (image, 1, 2, image)
+
     renderer = Renderer()
     image_1 = FakeImage('image')
     image_2 = FakeImage('image_to_paste')
     renderer.image = image_1
-    renderer.add_to_image(image_2, 3, 6, False, False)
+    renderer.add_to_image(image_2, 2, 4, False, False)
     assert renderer.image.paste_called
 
 
@@ -93,6 +103,14 @@ def test_get_image_pixel_boundaries():
     assert max_y == 25
 
 
+class FakeSizedImage:
+    """A fake image that is always 20x20"""
+    @staticmethod
+    def get_image_sizes():
+        """Gets fake image sizes"""
+        return (20, 20)
+
+
 def test_assemble(monkeypatch):
     """Tests image assembly calls are made correctly"""
     class VarStorage:
@@ -192,3 +210,240 @@ def test_output_fail(monkeypatch):
     renderer = Renderer()
     with raises(ValueError):
         assert renderer.output('flail').message == "Invalid output destination 'flail'"
+
+
+def get_test_renderer():
+    """Gets a renderer for a real component with overlapping images"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    component = assetpack.components['easy-dungeon-ddl-example-iso.nested-component-test']
+    image_location_list = component.get_image_location_list(0, 0)
+    return Renderer(image_pixel_list=assetpack.projection
+                    .get_image_pixel_list(0, 0, image_location_list))
+
+
+def test_get_images_in_region():
+    """Tests only images overlapping a region are returned, in order"""
+    renderer = Renderer([(FakeSizedImage(), -10, 0, False, False),
+                         (FakeSizedImage(), 40, 50, False, False)])
+    assert renderer.get_images_in_region(0, 0, 15, 15) == \
+        [renderer.image_pixel_list[0]]
+    assert renderer.get_images_in_region(20, 20, 65, 65) == \
+        renderer.image_pixel_list
+    assert renderer.get_images_in_region(35, 0, 55, 20) == []
+
+
+def test_get_images_in_viewport():
+    """Tests viewport queries keep painting order across batches"""
+    first = (FakeSizedImage(), 0, 0, False, False)
+    second = (FakeSizedImage(), 500, 500, False, False)
+    third = (FakeSizedImage(), 10, 10, False, False)
+    renderer = Renderer([first, second])
+    renderer.add_image_pixel_list([third])
+    assert renderer.image_pixel_list == [third, first, second]
+    assert renderer.get_images_in_viewport(0, 0, 1000, 1000) == \
+        renderer.image_pixel_list
+    assert renderer.get_images_in_viewport(15, 15, 25, 25) == [third, first]
+    assert renderer.get_images_in_viewport(510, 510, 511, 511) == [second]
+    assert renderer.get_images_in_viewport(100, 100, 200, 200) == []
+
+
+def test_tiles_match_assembled_image():
+    """Tests stitching the tiles back together gives the assembled image"""
+    renderer = get_test_renderer()
+    tiles = list(renderer.get_tiles(100))
+    width, height = renderer.get_canvas_size()
+    stitched = Image.new('RGBA', (width, height))
+    for column, row, tile in tiles:
+        assert tile.width <= 100
+        assert tile.height <= 100
+        stitched.paste(tile, (column*100, row*100))
+    assert stitched.tobytes() == renderer.output('variable').tobytes()
+
+
+def test_output_tiles(tmpdir):
+    """Tests tiles are written out to a directory"""
+    renderer = get_test_renderer()
+    renderer.output_tiles(str(tmpdir), 256)
+    width, height = renderer.get_canvas_size()
+    columns = -(-width // 256)
+    rows = -(-height // 256)
+    assert len(tmpdir.listdir()) == columns*rows
+    assert tmpdir.join(f"{columns-1}_{rows-1}.png").check()
+
+
+def test_depth_sort():
+    """Tests depth sorting paints by layer, then depth, then list order"""
+    back = (FakeSizedImage(), 0, 0, False, False, 0)
+    middle_1 = (FakeSizedImage(), 5, 5, False, False, 1)
+    middle_2 = (FakeSizedImage(), 6, 6, False, False, 1)
+    front = (FakeSizedImage(), 10, 10, False, False, 2)
+    prop = (FakeSizedImage(), 0, 0, False, False, 0)
+    renderer = Renderer([front, middle_1, middle_2, back], depth_sort=True)
+    renderer.add_image_pixel_list([prop], layer=1)
+    assert renderer.get_painting_order() == [back, middle_1, middle_2, front, prop]
+    assert renderer.get_images_in_viewport(0, 0, 21, 21) == \
+        [back, middle_1, middle_2, front, prop]
+
+
+def test_no_depth_sort():
+    """Tests without depth sorting the list order is the painting order"""
+    first = (FakeSizedImage(), 10, 10, False, False, 2)
+    second = (FakeSizedImage(), 0, 0, False, False, 0)
+    renderer = Renderer([first, second])
+    assert renderer.get_painting_order() == [first, second]
+
+
+def get_overlapping_renderer(cull):
+    """Gets a renderer for some top down floors that cover one another"""
+    assetpack = AssetpackFactory.load('assetpacks/example_top_down')
+    floor = assetpack.images['easy-dungeon-ddl-example-td.floor-1x1-exact']
+    fuzzy = assetpack.images['easy-dungeon-ddl-example-td.floor-1x1-fuzzy']
+    image_location_list = [(floor, 0, 0, False, False),
+                           (fuzzy, 1, 0, False, False),
+                           (floor, 1, 0, True, False),
+                           (floor, 1, 0, False, False)]
+    return Renderer(assetpack.projection.get_image_pixel_list(
+        0, 0, image_location_list), cull=cull)
+
+
+def test_cull_hidden_images():
+    """Tests covered images are culled without changing the output"""
+    renderer = get_overlapping_renderer(True)
+    width, height = renderer.get_canvas_size()
+    visible = renderer.cull_hidden_images(renderer.get_painting_order(),
+                                          0, 0, width, height)
+    assert len(visible) == 3
+    assert visible[0][0].asset_id == 'floor-1x1-fuzzy'
+    culled_image = renderer.output('variable')
+    full_image = get_overlapping_renderer(False).output('variable')
+    assert culled_image.tobytes() == full_image.tobytes()
+
+
+def test_cull_tiles():
+    """Tests culling tile by tile gives the same tiles"""
+    culled_tiles = list(get_overlapping_renderer(True).get_tiles(64))
+    full_tiles = list(get_overlapping_renderer(False).get_tiles(64))
+    for culled, full in zip(culled_tiles, full_tiles):
+        assert culled[2].tobytes() == full[2].tobytes()
+
+
+def test_cull_stacked_floors(monkeypatch):
+    """Tests floors stacked on opaque floors are never pasted, without
+     changing the output"""
+    assetpack = AssetpackFactory.load('assetpacks/example_top_down')
+    floor = assetpack.images['easy-dungeon-ddl-example-td.floor-1x1-exact']
+    image_location_list = [(floor, x, y, False, False)
+                           for layer in range(3)
+                           for x in range(5) for y in range(5)]
+    image_pixel_list = assetpack.projection.get_image_pixel_list(
+        0, 0, image_location_list)
+    full_image = Renderer(image_pixel_list).output('variable')
+    pasted = []
+    add_to_image = Renderer.add_to_image
+
+    def counting_add_to_image(self, *args):
+        """Counts the images actually pasted"""
+        pasted.append(args)
+        add_to_image(self, *args)
+
+    monkeypatch.setattr(Renderer, 'add_to_image', counting_add_to_image)
+    culled_image = Renderer(image_pixel_list, cull=True).output('variable')
+    assert len(pasted) == 25
+    assert culled_image.tobytes() == full_image.tobytes()
+
+
+def test_add_to_image_matches_masked_paste():
+    """Tests every paste path gives the same pixels as a full masked paste"""
+    assetpack = AssetpackFactory.load('assetpacks/example_top_down')
+    binary = Image.new('RGBA', (30, 20), (0, 0, 0, 0))
+    binary.paste((200, 10, 10, 255), (4, 2, 25, 15))
+    images = list(assetpack.images.values()) +\
+        [ImageAsset({"name": "", "id": "binary", "image": ""}, "test", "",
+                    image=binary)]
+    for image_asset in images:
+        for h_flip, v_flip in [(False, False), (True, False), (True, True)]:
+            renderer = Renderer()
+            renderer.initialise_image(150, 150)
+            renderer.image.paste((0, 50, 0, 128), (0, 0, 150, 150))
+            expected = renderer.image.copy()
+            image = image_asset.get_image(h_flip, v_flip)
+            expected.paste(image, (7, 9), image)
+            renderer.add_to_image(image_asset, 7, 9, h_flip, v_flip)
+            assert renderer.image.tobytes() == expected.tobytes()
+
+
+def test_scale():
+    """Tests a scaled renderer scales images and where they're anchored"""
+    assetpack = AssetpackFactory.load('assetpacks/example_isometric')
+    image = assetpack.images['easy-dungeon-ddl-example-iso.floor-1x1-exact']
+    image_location_list = [(image, 0, 0, False, False),
+                           (image, 4, 2, True, False)]
+    image_pixel_list = assetpack.projection.get_image_pixel_list(
+        0, 0, image_location_list)
+    renderer = Renderer(image_pixel_list=image_pixel_list, scale=0.5)
+    scaled_image, pixel_x, pixel_y, _, _ = renderer.image_pixel_list[0]
+    assert scaled_image.get_image_sizes() == (148, 95)
+    assert (pixel_x, pixel_y) == (-scaled_image.top_left['x'],
+                                  -scaled_image.top_left['y'])
+    scaled_image, pixel_x, pixel_y, _, _ = renderer.image_pixel_list[1]
+    anchor_x, anchor_y = assetpack.projection.get_location_in_pixels(4, 2)
+    assert pixel_x == round(anchor_x/2) - 148 + scaled_image.top_left['x']
+    assert pixel_y == round(anchor_y/2) - scaled_image.top_left['y']
+    full_width, full_height = Renderer(
+        image_pixel_list=image_pixel_list).get_canvas_size()
+    width, height = renderer.output('variable').size
+    assert abs(width-20 - (full_width-20)/2) <= 2
+    assert abs(height-20 - (full_height-20)/2) <= 2
+
+
+def test_output_file_object():
+    """Tests saving to a file object in other formats and compressions"""
+    renderer = get_test_renderer()
+    image = renderer.output('variable')
+    fast = io.BytesIO()
+    renderer.output('file', file=fast, compress_level=1)
+    small = io.BytesIO()
+    renderer.output('file', file=small, compress_level=9)
+    assert len(small.getvalue()) < len(fast.getvalue())
+    fast.seek(0)
+    assert Image.open(fast).tobytes() == image.tobytes()
+    jpeg = io.BytesIO()
+    renderer.output('file', file=jpeg, image_format='JPEG')
+    jpeg.seek(0)
+    jpeg_image = Image.open(jpeg)
+    assert jpeg_image.format == 'JPEG'
+    assert jpeg_image.size == image.size
+
+
+def test_output_stream(tmpdir):
+    """Tests streaming a PNG a strip at a time gives the same pixels"""
+    renderer = get_test_renderer()
+    image = renderer.output('variable')
+    for strip_height in [1, 7, 256, 10000]:
+        stream = io.BytesIO()
+        renderer.output('stream', file=stream, strip_height=strip_height,
+                        compress_level=1)
+        stream.seek(0)
+        assert Image.open(stream).tobytes() == image.tobytes()
+    path = str(tmpdir.join('streamed.png'))
+    renderer.output('stream', file=path)
+    assert Image.open(path).tobytes() == image.tobytes()
+    with raises(ValueError):
+        renderer.output('stream', file=io.BytesIO(), image_format='JPEG')
+
+
+def test_compress_strategy():
+    """Tests every zlib strategy saves and streams the same pixels"""
+    renderer = get_test_renderer()
+    image = renderer.output('variable')
+    sizes = set()
+    for strategy in [zlib.Z_FILTERED, zlib.Z_HUFFMAN_ONLY, zlib.Z_RLE]:
+        for destination in ['file', 'stream']:
+            output_file = io.BytesIO()
+            renderer.output(destination, file=output_file,
+                            compress_strategy=strategy)
+            sizes.add(len(output_file.getvalue()))
+            output_file.seek(0)
+            assert Image.open(output_file).tobytes() == image.tobytes()
+    # The strategies really are passed on, so they don't all compress alike.
+    assert len(sizes) > 1
@@ -0,0 +1,36 @@
+"""Tests the grid spatial index"""
+
+from ddl.spatial_index import GridIndex
+
+
+def test_get_cells():
+    """Tests a box is bucketed into every cell it touches, and no more"""
+    index = GridIndex(10)
+    assert index.get_cells(0, 0, 10, 10) == [(0, 0)]
+    assert index.get_cells(-1, 5, 11, 15) == [(-1, 0), (-1, 1), (0, 0),
+                                              (0, 1), (1, 0), (1, 1)]
+
+
+def test_query():
+    """Tests queries return overlapping items once each, in order"""
+    index = GridIndex(10)
+    index.insert(2, (0, 0, 30, 30), 'big')
+    index.insert(1, (5, 5, 8, 8), 'small')
+    index.insert(3, (-20, -20, -15, -15), 'far')
+    assert index.size == 3
+    assert index.query(0, 0, 100, 100) == ['small', 'big']
+    assert index.query(8, 8, 9, 9) == ['big']
+    assert index.query(-100, -100, 100, 100) == ['small', 'big', 'far']
+    index.clear()
+    assert index.query(-100, -100, 100, 100) == []
+
+
+def test_contains():
+    """Tests only a single item's box covering the whole box counts"""
+    index = GridIndex(10)
+    index.insert(1, (0, 0, 30, 30), 'big')
+    index.insert(2, (30, 0, 40, 30), 'next to big')
+    assert index.contains(5, 5, 30, 30)
+    assert index.contains(0, 12, 8, 14)
+    assert not index.contains(25, 5, 35, 10)
+    assert not index.contains(-5, 5, 10, 10)
@@ -1,6 +1,9 @@
 """Tests TagList"""
 
-from ddl.taglist import TagList
+from collections.abc import Set
+import random
+from pytest import raises
+from ddl.taglist import TagList, Tag, And, Or, Not, ComponentSampler
 
 
 class FakeComponent:
@@ -183,3 +186,175 @@ def test_get_list_fail_combo():
                                                        "tag2",
                                                        "tag3"])) == 0:
         raise AssertionError()
+
+
+def make_query_taglist():
+    """Makes a taglist with a few more components to query"""
+    taglist = make_add_taglist()
+    taglist.add_component(FakeComponent("component3", ['tag1', 'tag3']))
+    taglist.add_component(FakeComponent("component4", ['tag4']))
+    return taglist
+
+
+def test_get_list_leaves_tags_alone():
+    """Checks the list of tags asked for isn't changed"""
+    taglist = make_add_taglist()
+    tags = ["tag2", "tag3"]
+    taglist.get_components_that_match_tags(tags)
+    assert tags == ["tag2", "tag3"]
+
+
+def test_query_expressions():
+    """Checks AND, OR and NOT expressions match the right components"""
+    taglist = make_query_taglist()
+    assert set(taglist.query(Tag('tag1') & Tag('tag3'))) == {'component3'}
+    assert set(taglist.query(Tag('tag1') | Tag('tag4'))) ==\
+        {'component1', 'component3', 'component4'}
+    assert set(taglist.query(~Tag('tag2'))) == {'component3', 'component4'}
+    assert set(taglist.query(And(Tag('tag3'), Not(Tag('tag2')),
+                                 Or(Tag('tag1'), Tag('tag_umpt'))))) ==\
+        {'component3'}
+    assert len(taglist.query(Tag('tag_umpt') & Tag('tag1'))) == 0
+    assert len(taglist.query(And())) == 4
+
+
+def test_query_result_is_a_set():
+    """Checks query results behave like sets"""
+    taglist = make_query_taglist()
+    components = taglist.query(Tag('tag1'))
+    assert isinstance(components, Set)
+    assert 'component1' in components
+    assert 'component2' not in components
+    assert 'not_a_component' not in components
+    assert components == {'component1', 'component3'}
+    assert components & {'component3', 'component4'} == {'component3'}
+
+
+def test_append_shared_components():
+    """Checks appending taglists that share components doesn't duplicate"""
+    taglist1 = make_add_taglist()
+    taglist2 = TagList()
+    taglist2.add_component(FakeComponent("component2", ['tag4']))
+    taglist2.add_component(FakeComponent("component5", ['tag1']))
+    taglist1.append(taglist2)
+    assert len(taglist1.component_ids) == 3
+    assert set(taglist1.tag_components['tag1']) ==\
+        {'component1', 'component5'}
+    assert set(taglist1.tag_components['tag4']) == {'component2'}
+    assert taglist1.tag_counts['tag1'] == 2
+
+
+class WeightedFakeComponent(FakeComponent):
+    """A fake component with a weight"""
+    def __init__(self, name, tags, weight):
+        super().__init__(name, tags)
+        self.weight = weight
+
+
+def test_alias_table():
+    """Checks an alias table picks each component in proportion to its
+    weight"""
+    weights = [1, 2, 3, 0, 10]
+    sampler = ComponentSampler(['a', 'b', 'c', 'd', 'e'], weights)
+    chances = list(sampler.probabilities)
+    for index, (probability, alias) in enumerate(zip(sampler.probabilities,
+                                                     sampler.aliases)):
+        if alias != index:
+            chances[alias] = chances[alias] + 1 - probability
+    for chance, weight in zip(chances, weights):
+        assert abs(chance/len(weights) - weight/sum(weights)) < 1e-9
+
+
+def test_sample():
+    """Checks sampling only picks matching components, with or without
+    weights"""
+    taglist = make_query_taglist()
+    taglist.add_component(WeightedFakeComponent("component5", ['tag1'], 0))
+    taglist.add_component(WeightedFakeComponent("component6", ['tag1'], 50))
+    rng = random.Random(4)
+    picks = [taglist.sample(['tag1'], rng=rng) for _ in range(400)]
+    assert set(picks) == {'component1', 'component3', 'component5',
+                          'component6'}
+    picks = [taglist.sample(Tag('tag1'), weighted=True, rng=rng)
+             for _ in range(400)]
+    assert 'component5' not in picks
+    assert picks.count('component6') > 300
+    assert taglist.sample(Tag('tag1') & Tag('tag3')) == 'component3'
+    with raises(IndexError):
+        taglist.sample(['tag_umpt'])
+
+
+def test_samplers_are_cached():
+    """Checks samplers are reused until the taglist changes"""
+    taglist = make_query_taglist()
+    sampler = taglist.get_sampler(Tag('tag1') | Tag('tag4'), False)
+    assert taglist.get_sampler(Tag('tag1') | Tag('tag4'), False) is sampler
+    taglist.add_component(FakeComponent("component5", ['tag4']))
+    new_sampler = taglist.get_sampler(Tag('tag1') | Tag('tag4'), False)
+    assert new_sampler is not sampler
+    assert 'component5' in new_sampler.component_ids
+    other = TagList()
+    other.add_component(WeightedFakeComponent("component6", ['tag4'], 3))
+    taglist.append(other)
+    assert 'component6' in taglist.get_sampler(Tag('tag4'), True)\
+        .component_ids
+    assert taglist.component_weights[-1] == 3
+
+
+def test_remove_component():
+    """Checks removing a component takes it out of its tags, and its index
+    is given out again"""
+    taglist = make_query_taglist()
+    taglist.remove_component('component1')
+    assert set(taglist.tag_components['tag1']) == {'component3'}
+    assert set(taglist.tag_components['tag2']) == {'component2'}
+    taglist.remove_component('component4')
+    assert 'tag4' not in taglist.tag_components
+    assert len(taglist.query(~Tag('tag3'))) == 0
+    taglist.add_component(FakeComponent("component5", ['tag4']))
+    assert len(taglist.component_ids) == 4
+    assert set(taglist.query(Tag('tag4'))) == {'component5'}
+    assert taglist.sample(['tag4']) == 'component5'
+
+
+def test_rename_component():
+    """Checks renaming a component keeps its tags"""
+    taglist = make_query_taglist()
+    taglist.rename_component('component1', 'renamed')
+    assert set(taglist.tag_components['tag1']) == {'renamed', 'component3'}
+    assert 'component1' not in taglist.tag_components['tag2']
+    with raises(ValueError):
+        taglist.rename_component('renamed', 'component2')
+
+
+def test_append_after_remove():
+    """Checks appending a taglist with gaps in it keeps everything right"""
+    taglist1 = make_add_taglist()
+    taglist2 = make_query_taglist()
+    for component_id in ['component1', 'component2', 'component3']:
+        taglist2.remove_component(component_id)
+    taglist1.append(taglist2)
+    assert set(taglist1.tag_components['tag4']) == {'component4'}
+    assert taglist1.tag_counts['tag1'] == 1
+    taglist1.add_component(FakeComponent("component5", ['tag4']))
+    assert set(taglist1.tag_components['tag4']) ==\
+        {'component4', 'component5'}
+    assert len(taglist1.component_ids) == 6
+
+
+def test_results_outlive_changes():
+    """Checks a query result keeps its components after they are removed,
+    renamed, or their indices are reused"""
+    taglist = make_query_taglist()
+    result = taglist.query(Tag('tag1'))
+    tag_components = taglist.tag_components
+    taglist.remove_component('component1')
+    taglist.add_component(FakeComponent("component5", ['tag4']))
+    taglist.rename_component('component3', 'renamed')
+    assert set(result) == {'component1', 'component3'}
+    assert 'component1' in result
+    assert 'component5' not in result
+    assert 'renamed' not in result
+    assert set(tag_components['tag2']) == {'component1', 'component2'}
+    assert set(taglist.query(Tag('tag1'))) == {'renamed'}
+    assert set(taglist.query(Tag('tag4'))) == {'component4', 'component5'}
@@ -0,0 +1,34 @@
+"""Tests the validator's schema handling"""
+
+import os
+from pytest import raises
+from jsonschema import ValidationError
+from ddl.validator import Validator
+
+
+def test_validator_is_reused():
+    """Tests a schema is only compiled once"""
+    validator = Validator.get_validator('pack')
+    assert Validator.get_validator('pack') is validator
+
+
+def test_validator_reloads_on_change(monkeypatch):
+    """Tests a changed schema file is recompiled"""
+    validator = Validator.get_validator('pack')
+    mtime = os.path.getmtime('schemas/pack.json')
+    monkeypatch.setattr(os.path, "getmtime", lambda path: mtime + 1)
+    assert Validator.get_validator('pack') is not validator
+
+
+def test_validate_file_returns_json():
+    """Tests validating a file hands back the parsed JSON"""
+    pack_json = Validator.validate_file('assetpacks/example_isometric/pack.json',
+                                        'pack')
+    assert pack_json['projection'] == 'isometric'
+
+
+def test_validate_json_error():
+    """Tests invalid JSON raises the most relevant error"""
+    with raises(ValidationError) as error:
+        Validator.validate_json({"images": [{"id": "a"}]}, 'images')
+    assert "is a required property" in error.value.message